@@ -0,0 +1,235 @@
+"""
+Load benchmark of the read endpoints against a database made by seed.py. It drives the app
+either in process through the WSGI test client or over HTTP against a real gunicorn, then
+reports p50/p95/p99 latency and throughput per endpoint and saves everything as JSON
+(benchmarks/results/<scale>-<mode>-<commit>.json) so two commits can be compared.
+
+    $ python benchmarks/seed.py 100k
+    $ python benchmarks/load.py 100k --mode gunicorn --workers 4 --concurrency 16
+    $ python benchmarks/load.py 100k --mode gunicorn --compare benchmarks/results/100k-gunicorn-<commit>.json
+
+Responses are cached by the app (CACHE_BACKEND), ids are random so the single row endpoints
+mostly miss at the bigger scales while the list endpoints mostly hit.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+from seed import rows_for, sizes, database_url, PASSWORD
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def scenarios(counts):
+    # name -> (needs a token, url builder)
+    people, planets = counts["people"], counts["planets"]
+    return {
+        "GET /people": (False, lambda rnd: "/people"),
+        "GET /people?gender": (False, lambda rnd: f"/people?gender={rnd.choice(('male', 'female', 'n/a'))}&limit=50"),
+        "GET /people?sort=name&fields": (False, lambda rnd: "/people?sort=name&fields=id,name,gender&limit=100"),
+        "GET /people/<id>": (False, lambda rnd: f"/people/{rnd.randint(1, people)}"),
+        "GET /planets": (False, lambda rnd: "/planets"),
+        "GET /planets/<id>": (False, lambda rnd: f"/planets/{rnd.randint(1, planets)}"),
+        "GET /user/favorites": (True, lambda rnd: "/user/favorites"),
+        "GET /user/favorites?embed": (True, lambda rnd: "/user/favorites?embed=true"),
+        "GET /user/favorites/people": (True, lambda rnd: "/user/favorites/people"),
+    }
+
+
+def percentile(values, fraction):
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))]
+
+
+def summary(latencies, errors, wall):
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "throughput_rps": len(latencies) / wall
+    }
+
+
+###############
+# Test client #
+###############
+class ClientDriver:
+    # in process, no network and no worker pool: measures the app itself
+
+    def __init__(self, url):
+        os.environ['DB_CONNECTION_STRING'] = url
+        os.environ.setdefault('FLASK_APP_KEY', 'benchmark')
+        sys.path.insert(0, os.path.join(ROOT, 'src'))
+        from main import app
+        self.client = app.test_client()
+
+    def login(self, email):
+        return self.client.post('/login', json={"email": email, "password": PASSWORD}).json["token"]
+
+    def get(self, path, headers):
+        response = self.client.get(path, headers=headers)
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+############
+# Gunicorn #
+############
+class GunicornDriver:
+
+    def __init__(self, url, workers=4, threads=1):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, DB_CONNECTION_STRING=url, FLASK_APP_KEY=os.environ.get('FLASK_APP_KEY', 'benchmark'))
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', os.path.join(ROOT, 'src'),
+             '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads), '--log-level', 'warning'],
+            env=env
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=256))
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                self.session.get(self.base + '/metrics', timeout=5)
+                break
+            except requests.RequestException:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.close()
+                    raise RuntimeError("gunicorn didn't start")
+                time.sleep(0.2)
+
+    def login(self, email):
+        return self.session.post(self.base + '/login', json={"email": email, "password": PASSWORD}).json()["token"]
+
+    def get(self, path, headers):
+        response = self.session.get(self.base + path, headers=headers)
+        return response.status_code
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+def run(driver, counts, total, concurrency, warmup, seed=0):
+    rnd = random.Random(seed)
+    users = [rnd.randint(1, counts["users"]) for _ in range(max(concurrency, 1))]
+    tokens = [driver.login(f"user{user}@bench.local") for user in users]
+    results = {}
+
+    for name, (auth, build) in scenarios(counts).items():
+        paths = [build(rnd) for _ in range(warmup + total)]
+
+        def call(index):
+            headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"} if auth else {}
+            started = time.perf_counter()
+            status = driver.get(paths[index], headers)
+            return time.perf_counter() - started, status
+
+        for index in range(warmup):
+            call(index)
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                calls = list(executor.map(call, range(warmup, warmup + total)))
+        else:
+            calls = [call(index) for index in range(warmup, warmup + total)]
+        wall = time.perf_counter() - started
+
+        latencies = [elapsed for elapsed, status in calls if status < 400]
+        results[name] = summary(latencies, len(calls) - len(latencies), wall)
+        print(format_row(name, results[name]))
+    return results
+
+
+def format_row(name, result, previous=None):
+    if not result["requests"]:
+        return f"{name:32} all {result['errors']} requests failed"
+    row = (f"{name:32} p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+           f"p99 {result['p99_ms']:8.2f}ms  {result['throughput_rps']:9.1f} req/s")
+    if result["errors"]:
+        row += f"  errors {result['errors']}"
+    if previous and previous.get("requests"):
+        row += (f"  | p95 {(result['p95_ms'] / previous['p95_ms'] - 1) * 100:+6.1f}%"
+                f"  req/s {(result['throughput_rps'] / previous['throughput_rps'] - 1) * 100:+6.1f}%")
+    return row
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scale', nargs='?', default='1k')
+    parser.add_argument('--db', help="database url, benchmarks/data/bench-<scale>.db by default")
+    parser.add_argument('--mode', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--requests', type=int, default=500, help="measured requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    parser.add_argument('--threads', type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument('--output', help="json file, benchmarks/results/<scale>-<mode>-<commit>.json by default")
+    parser.add_argument('--compare', help="previous json result to diff against")
+    args = parser.parse_args()
+
+    url = args.db or database_url(args.scale)
+    counts = sizes(rows_for(args.scale))
+    driver = ClientDriver(url) if args.mode == 'client' else GunicornDriver(url, args.workers, args.threads)
+    try:
+        endpoints = run(driver, counts, args.requests, args.concurrency, args.warmup)
+    finally:
+        driver.close()
+
+    report = {
+        "commit": commit(),
+        "date": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "scale": args.scale,
+        "rows": counts,
+        "mode": args.mode,
+        "database": url.split(':', 1)[0],
+        "python": platform.python_version(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "workers": args.workers if args.mode == 'gunicorn' else None,
+        "endpoints": endpoints
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.scale}-{args.mode}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as result:
+        json.dump(report, result, indent=2)
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            before = json.load(previous)
+        print(f"\nagainst {before['commit']} ({before['date']})")
+        for name, result in endpoints.items():
+            print(format_row(name, result, before["endpoints"].get(name)))
+
+
+if __name__ == '__main__':
+    main()
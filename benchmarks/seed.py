@@ -0,0 +1,112 @@
+"""
+Synthetic database for the load benchmarks: People, Planets, Users and Favorites at a given
+scale (1k, 100k, 1m or any number of people). Planets are a tenth of the people, there is one
+user every hundred people and every user has 10 favorites. Every user logs in with `bench`.
+
+    $ python benchmarks/seed.py [scale] [database url]
+
+Without a url the data goes to benchmarks/data/bench-<scale>.db (SQLite), a PostgreSQL url
+works too. The tables are dropped and created again.
+"""
+import os
+import sys
+import time
+
+SCALES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+CHUNK_SIZE = 10000
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+PASSWORD = 'bench'
+
+HAIR = ('black', 'blond', 'brown', 'grey', 'none', 'red', 'white')
+SKIN = ('dark', 'fair', 'green', 'grey', 'light', 'metal', 'pale')
+EYES = ('black', 'blue', 'brown', 'green', 'hazel', 'red', 'yellow')
+GENDERS = ('female', 'hermaphrodite', 'male', 'n/a')
+CLIMATES = ('arid', 'frozen', 'humid', 'murky', 'temperate', 'tropical')
+GRAVITIES = ('0.5 standard', '1 standard', '1.5 standard', '2 standard')
+TERRAINS = ('desert', 'forests', 'grasslands', 'jungle', 'mountains', 'ocean', 'swamp', 'tundra')
+
+
+def rows_for(scale):
+    return SCALES.get(str(scale).lower()) or int(scale)
+
+
+def database_url(scale):
+    return f"sqlite:///{os.path.abspath(os.path.join(DATA_DIR, f'bench-{scale}.db'))}"
+
+
+def sizes(people):
+    planets = max(people // 10, 10)
+    users = max(people // 100, 10)
+    return {"people": people, "planets": planets, "users": users, "favorites": users * 10}
+
+
+def person(i):
+    return {
+        "name": f"Character {i}", "height": 80 + i % 150, "mass": 20 + i % 140,
+        "hair_color": HAIR[i % len(HAIR)], "skin_color": SKIN[i % len(SKIN)], "eye_color": EYES[i % len(EYES)],
+        "birth_year": f"{i % 900}BBY", "gender": GENDERS[i % len(GENDERS)], "swapi_id": i
+    }
+
+
+def planet(i):
+    return {
+        "name": f"Planet {i}", "diameter": 1000 + i % 20000, "climate": CLIMATES[i % len(CLIMATES)],
+        "gravity": GRAVITIES[i % len(GRAVITIES)], "terrain": TERRAINS[i % len(TERRAINS)],
+        "surface_water": str(i % 100), "population": str(i * 1000), "swapi_id": i
+    }
+
+
+def favorites(user_id, counts):
+    # half people, half planets, spread over the whole table
+    rows = []
+    for n in range(10):
+        nature = 'People' if n % 2 == 0 else 'Planet'
+        total = counts["people"] if nature == 'People' else counts["planets"]
+        rows.append({"user_id": user_id, "name": f"Favorite {n}", "nature": nature, "nature_id": (user_id * 7919 + n * 104729) % total + 1})
+    return rows
+
+
+def insert(db, model, rows, total):
+    started = time.perf_counter()
+    for start in range(0, total, CHUNK_SIZE):
+        db.session.execute(db.insert(model), [rows(i) for i in range(start + 1, min(start + CHUNK_SIZE, total) + 1)])
+        db.session.commit()
+    print(f"{model.__tablename__:10} {total:>9} rows in {time.perf_counter() - started:6.1f}s")
+
+
+def seed(scale, url=None):
+    url = url or database_url(scale)
+    if url.startswith('sqlite:///'):
+        os.makedirs(DATA_DIR, exist_ok=True)
+    os.environ['DB_CONNECTION_STRING'] = url
+    os.environ.setdefault('FLASK_APP_KEY', 'benchmark')
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+    from main import app
+    from models import db, User, Favorites, People, Planets
+    from sync import backfill
+
+    counts = sizes(rows_for(scale))
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        insert(db, People, person, counts["people"])
+        insert(db, Planets, planet, counts["planets"])
+        insert(db, User, lambda i: {"email": f"user{i}@bench.local", "password": PASSWORD}, counts["users"])
+        started = time.perf_counter()
+        for start in range(0, counts["users"], CHUNK_SIZE // 10):
+            db.session.execute(db.insert(Favorites), [
+                row for user_id in range(start + 1, min(start + CHUNK_SIZE // 10, counts["users"]) + 1)
+                for row in favorites(user_id, counts)
+            ])
+            db.session.commit()
+        print(f"{'favorites':10} {counts['favorites']:>9} rows in {time.perf_counter() - started:6.1f}s")
+        # the bulk inserts skip the ORM, /sync needs the versions
+        backfill()
+    return url, counts
+
+
+if __name__ == '__main__':
+    scale = sys.argv[1] if len(sys.argv) > 1 else '1k'
+    url, _ = seed(scale, sys.argv[2] if len(sys.argv) > 2 else None)
+    print(url)
@@ -0,0 +1,56 @@
+"""
+Throughput of a 10k row People payload: ORM entities + serialize() + stdlib json
+against column tuples + orjson (stdlib json when orjson isn't installed).
+
+    $ python benchmarks/serialization.py [rows]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ['DB_CONNECTION_STRING'] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault('FLASK_APP_KEY', 'benchmark')
+
+from main import app
+from models import db, People
+from serializers import columns, render, dumps, orjson
+
+
+def seed(rows):
+    db.create_all()
+    db.session.execute(db.insert(People), [{
+        "name": f"Character {i}", "height": 150 + i % 60, "mass": 50 + i % 80, "hair_color": "brown",
+        "skin_color": "fair", "eye_color": "blue", "birth_year": f"{i % 900}BBY", "gender": "male"
+    } for i in range(rows)])
+    db.session.commit()
+
+
+def orm_stdlib():
+    db.session.expunge_all()
+    return json.dumps([character.serialize() for character in People.query.all()])
+
+
+def tuples_fast():
+    return dumps(render(db.session.query(*columns(People)).all(), People.public))
+
+
+def best(function, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), len(body)
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with app.app_context():
+        seed(rows)
+        print(f"{rows} rows, encoder: {'orjson' if orjson else 'json (orjson not installed)'}")
+        for name, function in (("ORM + serialize() + json", orm_stdlib), ("column tuples + fast encoder", tuples_fast)):
+            seconds, size = best(function)
+            print(f"{name:30} {seconds * 1000:8.1f} ms   {rows / seconds:10.0f} rows/s   {size} bytes")
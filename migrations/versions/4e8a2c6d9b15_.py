@@ -0,0 +1,45 @@
+"""empty message
+
+Revision ID: 4e8a2c6d9b15
+Revises: 9d4b7e1c2a60
+Create Date: 2026-10-18 22:03:51.672930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e8a2c6d9b15'
+down_revision = '9d4b7e1c2a60'
+branch_labels = None
+depends_on = None
+
+TABLES = ('people', 'planets')
+
+
+def upgrade():
+    # FTS5 name indexes for /search, only on SQLite (PostgreSQL has the trigram indexes,
+    # MySQL searches by prefix on the name index)
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in TABLES:
+        op.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5(name, content='{table}', content_rowid='id')")
+        op.execute(f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+                   f"INSERT INTO {table}_fts (rowid, name) VALUES (new.id, new.name); END")
+        op.execute(f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+                   f"INSERT INTO {table}_fts ({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); END")
+        op.execute(f"CREATE TRIGGER {table}_fts_update AFTER UPDATE OF name ON {table} BEGIN "
+                   f"INSERT INTO {table}_fts ({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+                   f"INSERT INTO {table}_fts (rowid, name) VALUES (new.id, new.name); END")
+        # the rows already stored
+        op.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in TABLES:
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f"DROP TRIGGER {table}_fts_{trigger}")
+        op.execute(f"DROP TABLE {table}_fts")
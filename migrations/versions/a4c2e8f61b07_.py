@@ -0,0 +1,33 @@
+"""empty message
+
+Revision ID: a4c2e8f61b07
+Revises: d91f3b7c2e54
+Create Date: 2026-10-18 16:02:41.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c2e8f61b07'
+down_revision = 'd91f3b7c2e54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # trigram indexes only exist on PostgreSQL: SQLite searches its FTS5 tables (4e8a2c6d9b15),
+    # MySQL a LIKE prefix query on the name index
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_people_name_trgm', 'people', ['name'], unique=False, postgresql_using='gist', postgresql_ops={'name': 'gist_trgm_ops'})
+    op.create_index('ix_planets_name_trgm', 'planets', ['name'], unique=False, postgresql_using='gist', postgresql_ops={'name': 'gist_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_planets_name_trgm', table_name='planets', postgresql_using='gist')
+    op.drop_index('ix_people_name_trgm', table_name='people', postgresql_using='gist')
@@ -1,6 +1,6 @@
 import os
 from flask_admin import Admin
-from models import db, User, Favorites, People, Planets
+from models import db, User, Favorites, People, Planets, Checkpoint, Job, Tombstone
 from flask_admin.contrib.sqla import ModelView
 
 def setup_admin(app):
@@ -14,6 +14,9 @@ def setup_admin(app):
     admin.add_view(ModelView(Favorites, db.session))
     admin.add_view(ModelView(People, db.session))
     admin.add_view(ModelView(Planets, db.session))
+    admin.add_view(ModelView(Checkpoint, db.session))
+    admin.add_view(ModelView(Job, db.session))
+    admin.add_view(ModelView(Tombstone, db.session))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
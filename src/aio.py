@@ -0,0 +1,143 @@
+"""
+Async versions of the I/O bound routes, used by the ASGI entry point (asgi.py): the catalogue reads
+and the favorites with embeds wait on the database through the async driver of DB_CONNECTION_STRING,
+the /events feed waits on the broker. They run inside the Flask request context, so the
+hooks, error handlers, cache, ETags, compression and the choice of a read replica behave exactly
+like in the sync routes.
+"""
+from functools import wraps
+from flask import Response, request, jsonify, current_app
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from models import Favorites, People, Planets
+from cache import cached_async, row_key, list_key, conditional, read_async_with
+from utils import list_statement, list_page
+from pool import engine_options
+from replicas import replica_read, request_replica
+from events import subscription, stream_async, SSE_HEADERS
+
+# sync driver -> async driver of the same database
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'mysql': 'mysql+aiomysql', 'sqlite': 'sqlite+aiosqlite'}
+
+# created on first use, inside the event loop of the worker: the primary's under None,
+# the replicas' under their SQLALCHEMY_BINDS key
+engines = {}
+Sessions = {}
+
+
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def session(model=None):
+    # reads of `model` go to the replica the sync session would pick (replicas.py)
+    bind = request_replica() if replica_read(model) else None
+    if bind not in Sessions:
+        config = current_app.config
+        uri = config['SQLALCHEMY_DATABASE_URI'] if bind is None else config['SQLALCHEMY_BINDS'][bind]['url']
+        # same DB_POOL_* settings, the async engine brings its own pool class
+        options = engine_options(uri)
+        options.pop('poolclass', None)
+        engines[bind] = create_async_engine(async_url(uri), **options)
+        Sessions[bind] = async_sessionmaker(engines[bind], expire_on_commit=False)
+    return Sessions[bind]()
+
+
+async def all_rows(statement):
+    async with session() as db_session:
+        return (await db_session.execute(statement)).all()
+
+
+# the versions behind the ETags and cache keys are read through the async engine too
+read_async_with(all_rows)
+
+
+async def close():
+    for engine in engines.values():
+        await engine.dispose()
+
+
+def authenticated(function):
+    # jwt_required() for coroutine views
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        verify_jwt_in_request()
+        return await function(*args, **kwargs)
+    return wrapper
+
+
+#########################
+# Lecturas del catalogo #
+#########################
+async def catalogue(model, row_id, missing):
+    if row_id is None:
+        async def load_page():
+            statement, fields, sort, limit = list_statement(model, request.args)
+            async with session(model) as db_session:
+                rows = (await db_session.execute(statement)).all()
+            return list_page(rows, model, fields, sort, limit)
+
+        results, next_cursor = await cached_async(list_key(model), load_page)
+        return jsonify({
+            "results": results,
+            "next": next_cursor
+        }), 200
+
+    async def load_row():
+        async with session(model) as db_session:
+            row = await db_session.get(model, row_id)
+        return row.serialize() if row is not None else None
+
+    row = await cached_async(row_key(model, row_id), load_row)
+    if row is None:
+        return jsonify({
+            "msg": missing
+        }), 404
+    return jsonify(row), 200
+
+
+@conditional('People')
+async def people(character_id=None):
+    return await catalogue(People, character_id, "Character not found")
+
+
+@conditional('Planets')
+async def planets(planet_id=None):
+    return await catalogue(Planets, planet_id, "Planet not found")
+
+
+##########################
+# Favoritos de cada User #
+##########################
+@authenticated
+@conditional('People', 'Planets', per_user=('Favorites',))
+async def favorites():
+    user_id = get_jwt_identity()
+    async with session(Favorites) as db_session:
+        if request.args.get('embed') == 'true':
+            rows = (await db_session.execute(Favorites.records_statement(user_id))).all()
+            return jsonify([favorite.serialize_with_record(record) for favorite, record in Favorites.pair_records(rows)])
+
+        favorites = (await db_session.scalars(select(Favorites).filter_by(user_id=user_id))).all()
+    return jsonify([favorite.serialize() for favorite in favorites])
+
+
+####################
+# Flujo de cambios #
+####################
+async def events():
+    # one task per connection instead of one thread
+    user_id, types, last_id = subscription()
+    return Response(stream_async(user_id, types, last_id), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+# (endpoint, method) of the sync route -> the async view that replaces it under ASGI
+VIEWS = {
+    ('handle_people', 'GET'): people,
+    ('handle_planetas', 'GET'): planets,
+    ('handle_get_favorites', 'GET'): favorites,
+    ('handle_events', 'GET'): events,
+}
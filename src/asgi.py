@@ -0,0 +1,128 @@
+# ASGI entry point, the alternative to wsgi.py:
+#
+#     $ uvicorn asgi:application --app-dir ./src/ --workers 4
+#     $ gunicorn asgi:application --chdir ./src/ -k uvicorn.workers.UvicornWorker
+#
+# It needs the async driver of the database (aiosqlite, asyncpg or aiomysql).
+# The routes in aio.VIEWS are awaited on the event loop, every other request goes to the
+# sync Flask app through asgiref's WSGI adapter, so both modes serve the same API.
+
+import io
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.exceptions import HTTPException
+from flask import request
+from main import app
+import aio
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+executor = ThreadPoolExecutor(max_workers=ASGI_THREADS)
+
+
+class PooledInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI request on the same single thread by default, ours get a pool.
+    # The request body is spooled to a temporary file past 64KB
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False, executor=executor)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+
+    async def __call__(self, scope, receive, send):
+        await PooledInstance(self.wsgi_application)(scope, receive, send)
+
+
+sync_app = PooledWsgiToAsgi(app)
+
+
+def environ_for(scope):
+    # the async views are all GETs, so there is no body to read
+    instance = WsgiToAsgiInstance(app)
+    instance.scope = scope
+    return instance.build_environ(scope, io.BytesIO())
+
+
+def async_view(environ):
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return aio.VIEWS.get((endpoint, environ['REQUEST_METHOD']))
+
+
+def start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+    }
+
+
+async def run_async(environ, view, receive, send):
+    # Flask's full_dispatch_request with an awaited view: before/after_request hooks,
+    # error handlers and teardown run as for any other route
+    with app.request_context(environ):
+        try:
+            try:
+                response = app.preprocess_request()
+                if response is None:
+                    response = await view(**request.view_args)
+            except Exception as error:
+                response = app.handle_user_exception(error)
+            response = app.finalize_request(response)
+        except Exception as error:
+            response = app.handle_exception(error)
+        streamed = hasattr(response.response, '__aiter__')
+        if not streamed:
+            body = response.get_data()
+            response.close()
+    await send(start_message(response.status_code, response.headers.items()))
+    if streamed:
+        await stream_body(response.response, receive, send)
+    else:
+        await send({'type': 'http.response.body', 'body': body})
+
+
+async def stream_body(body, receive, send):
+    # async iterable bodies (the /events feed) go out chunk by chunk until they end
+    # or the client goes away, whatever comes first
+    async def pump():
+        async for chunk in body:
+            await send({'type': 'http.response.body', 'body': chunk.encode() if isinstance(chunk, str) else chunk, 'more_body': True})
+
+    async def disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    pumping = asyncio.ensure_future(pump())
+    waiting = asyncio.ensure_future(disconnect())
+    await asyncio.wait((pumping, waiting), return_when=asyncio.FIRST_COMPLETED)
+    for task in (pumping, waiting):
+        task.cancel()
+    await asyncio.gather(pumping, waiting, return_exceptions=True)
+    await body.aclose()
+    if not waiting.done() or waiting.cancelled():
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await aio.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    environ = environ_for(scope)
+    view = async_view(environ)
+    if view is None:
+        await sync_app(scope, receive, send)
+    else:
+        await run_async(environ, view, receive, send)
@@ -0,0 +1,270 @@
+"""
+Batch create/update/delete for people, planets and favorites. Every item gets its own
+result so one bad row doesn't sink the rest, the valid ones are written in one transaction.
+"""
+import os
+from flask import request
+from models import db, Favorites
+from utils import APIException
+from schema import ValidationError
+from sync import stamp_rows, delete_rows
+
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 1000))
+NATURES = ('People', 'Planet')
+
+
+def batch_items():
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        raise APIException("The body must be a non empty array", status_code=400)
+    if len(items) > MAX_BATCH_SIZE:
+        raise APIException(f"A batch can't have more than {MAX_BATCH_SIZE} items", status_code=413)
+    return items
+
+
+def failed(results, index, status, msg):
+    results[index] = {"index": index, "status": status, "msg": msg}
+
+
+def report(results):
+    errors = len([result for result in results if result["status"] >= 400])
+    return {
+        "results": results,
+        "succeeded": len(results) - errors,
+        "failed": errors
+    }
+
+
+def commit(results, pending, write=None):
+    # pending: [(index, callable building the result)], they run after the flush
+    # (ids are known by then) and before the commit expires the instances.
+    # write: the bulk statements of the batch, a failure there is rolled back and reported the same way
+    try:
+        if write is not None:
+            write()
+        db.session.flush()
+        done = [(index, result()) for index, result in pending]
+        db.session.commit()
+    except Exception as error:
+        db.session.rollback()
+        for index, _ in pending:
+            failed(results, index, 500, str(error.args))
+        return False
+    for index, result in done:
+        results[index] = dict(result, index=index)
+    return True
+
+
+def check_unique(model, rows, results):
+    # rows: [(index, item, id or None)], drops the items that would break a unique column
+    for column in model.unique:
+        values = [item[column] for _, item, _ in rows if column in item]
+        taken = dict(db.session.query(getattr(model, column), model.id).filter(getattr(model, column).in_(values)).all())
+        seen = set()
+        kept = []
+        for index, item, row_id in rows:
+            value = item.get(column)
+            if value is not None and (value in seen or taken.get(value, row_id) != row_id):
+                failed(results, index, 409, f"{column} {value} already exists")
+                continue
+            seen.add(value)
+            kept.append((index, item, row_id))
+        rows = kept
+    return rows
+
+
+############################
+# People / Planets en lote #
+############################
+def create_many(model, items):
+    results = [None] * len(items)
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            failed(results, index, 400, "Every item must be an object")
+            continue
+        if "swapi_id" in item:
+            failed(results, index, 400, "swapi_id can't be set, it comes from SWAPI")
+            continue
+        try:
+            rows.append((index, model.schema.load(item, required=model.required), None))
+        except ValidationError as error:
+            failed(results, index, 400, error.message)
+
+    rows = check_unique(model, rows, results)
+    instances = [(index, model(**values)) for index, values, _ in rows]
+    db.session.add_all([instance for _, instance in instances])
+
+    commit(results, [
+        (index, lambda instance=instance: {"status": 201, "id": instance.id})
+        for index, instance in instances
+    ])
+    return report(results)
+
+
+def update_many(model, items):
+    results = [None] * len(items)
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            failed(results, index, 400, "Every item must be an object with an integer id")
+            continue
+        unknown = [field for field in item if field != "id" and field not in model.required]
+        if unknown:
+            failed(results, index, 400, f"Unknown fields: {', '.join(unknown)}")
+            continue
+        try:
+            rows.append((index, dict(model.schema.load(item), id=item["id"]), item["id"]))
+        except ValidationError as error:
+            failed(results, index, 400, error.message)
+
+    existing = {row_id for (row_id,) in db.session.query(model.id).filter(model.id.in_([row_id for _, _, row_id in rows]))}
+    found = []
+    for index, item, row_id in rows:
+        if row_id in existing:
+            found.append((index, item, row_id))
+        else:
+            failed(results, index, 404, f"{model.__name__} {row_id} not found")
+
+    rows = check_unique(model, found, results)
+
+    def write():
+        if rows:
+            # ORM bulk UPDATE ... WHERE id = :id, executemany style
+            db.session.execute(db.update(model), stamp_rows(model, [item for _, item, _ in rows]))
+    commit(results, [(index, lambda row_id=row_id: {"status": 200, "id": row_id}) for index, _, row_id in rows], write)
+    return report(results)
+
+
+def delete_many(model, items):
+    results = [None] * len(items)
+    rows = []
+    for index, item in enumerate(items):
+        row_id = item.get("id") if isinstance(item, dict) else item
+        if not isinstance(row_id, int):
+            failed(results, index, 400, "Every item must be an id or an object with an integer id")
+        else:
+            rows.append((index, row_id))
+
+    existing = {row_id for (row_id,) in db.session.query(model.id).filter(model.id.in_([row_id for _, row_id in rows]))}
+    deleted = []
+    for index, row_id in rows:
+        if row_id in existing:
+            deleted.append((index, row_id))
+        else:
+            failed(results, index, 404, f"{model.__name__} {row_id} not found")
+
+    commit(results, [(index, lambda row_id=row_id: {"status": 204, "id": row_id}) for index, row_id in deleted],
+           lambda: delete_rows(model, [(row_id, None) for _, row_id in deleted]))
+    return report(results)
+
+
+#####################
+# Favoritos en lote #
+#####################
+def check_favorite(item, fields):
+    if not isinstance(item, dict):
+        return "Every item must be an object"
+    if item.get("nature") not in NATURES:
+        return f"nature must be one of {', '.join(NATURES)}"
+    if not isinstance(item.get("nature_id"), int):
+        return "nature_id must be int"
+    for field in fields:
+        if not item.get(field):
+            return f"{field} is required"
+    return None
+
+
+def user_favorites(user_id, rows):
+    # rows: [(index, item)] -> {(nature, nature_id): Favorites} in a single query
+    keys = [(item["nature"], item["nature_id"]) for _, item in rows]
+    if not keys:
+        return {}
+    favorites = Favorites.query.filter(
+        Favorites.user_id == user_id,
+        db.tuple_(Favorites.nature, Favorites.nature_id).in_(keys)
+    ).all()
+    return {(favorite.nature, favorite.nature_id): favorite for favorite in favorites}
+
+
+def create_favorites(user_id, items):
+    results = [None] * len(items)
+    rows = []
+    for index, item in enumerate(items):
+        error = check_favorite(item, ("name",))
+        if error:
+            failed(results, index, 400, error)
+        else:
+            rows.append((index, item))
+
+    # the name is unique per user
+    taken = {name for (name,) in db.session.query(Favorites.name).filter(
+        Favorites.user_id == user_id, Favorites.name.in_([item["name"] for _, item in rows])
+    )}
+    instances = []
+    for index, item in rows:
+        if item["name"] in taken:
+            failed(results, index, 409, f"name {item['name']} already exists")
+            continue
+        taken.add(item["name"])
+        instances.append((index, Favorites(name=item["name"], nature=item["nature"], nature_id=item["nature_id"], user_id=user_id)))
+
+    db.session.add_all([instance for _, instance in instances])
+    commit(results, [
+        (index, lambda instance=instance: dict(instance.serialize(), status=201))
+        for index, instance in instances
+    ])
+    return report(results)
+
+
+def update_favorites(user_id, items):
+    results = [None] * len(items)
+    rows = []
+    for index, item in enumerate(items):
+        error = check_favorite(item, ("name",))
+        if error:
+            failed(results, index, 400, error)
+        else:
+            rows.append((index, item))
+
+    favorites = user_favorites(user_id, rows)
+    updated = []
+    for index, item in rows:
+        favorite = favorites.get((item["nature"], item["nature_id"]))
+        if favorite is None:
+            failed(results, index, 404, f"{item['nature']} {item['nature_id']} is not a favorite")
+            continue
+        favorite.name = item["name"]
+        updated.append((index, favorite))
+
+    commit(results, [
+        (index, lambda favorite=favorite: dict(favorite.serialize(), status=200))
+        for index, favorite in updated
+    ])
+    return report(results)
+
+
+def delete_favorites(user_id, items):
+    results = [None] * len(items)
+    rows = []
+    for index, item in enumerate(items):
+        error = check_favorite(item, ())
+        if error:
+            failed(results, index, 400, error)
+        else:
+            rows.append((index, item))
+
+    favorites = user_favorites(user_id, rows)
+    deleted = []
+    for index, item in rows:
+        favorite = favorites.pop((item["nature"], item["nature_id"]), None)
+        if favorite is None:
+            failed(results, index, 404, f"{item['nature']} {item['nature_id']} is not a favorite")
+            continue
+        deleted.append((index, favorite))
+
+    commit(results, [
+        (index, lambda nature=favorite.nature, nature_id=favorite.nature_id: {"status": 204, "nature": nature, "nature_id": nature_id})
+        for index, favorite in deleted
+    ], lambda: delete_rows(Favorites, [(favorite.id, user_id) for _, favorite in deleted]))
+    return report(results)
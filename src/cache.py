@@ -0,0 +1,442 @@
+"""
+Read-through cache for the catalogue (people and planets) endpoints
+"""
+import os
+import json
+import base64
+import time
+import calendar
+import uuid
+import inspect
+import sqlite3
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, make_response, g, current_app
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', 1024))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 300))
+# memory | sqlite | redis
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_URL = os.environ.get('CACHE_URL', 'sqlite:////tmp/star-wars-api-cache.db')
+
+
+############
+# Backends #
+############
+# Every backend exposes get/set/get_bytes/set_bytes/version/modified/incr/stats. Entries are never
+# deleted on a write: each model has a version counter that is part of every key,
+# a write bumps the counter and the old entries just stop being reachable. With the memory
+# backend the models with a sync version read theirs from the database instead (see `versioned`).
+# `epoch` tells apart counters that started over (e.g. a restarted process).
+
+STARTED_AT = time.time()
+
+class MemoryBackend:
+    # bounded in-process cache, the least recently used entry goes away first
+    # and every entry expires `ttl` seconds after it was stored
+
+    def __init__(self, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.modified_at = {}
+        self.epoch = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_bytes(self, key):
+        return self.get(key)
+
+    def set_bytes(self, key, value):
+        self.set(key, value)
+
+    def version(self, name):
+        return self.counters.get(name, 0)
+
+    def modified(self, name):
+        return self.modified_at.get(name, STARTED_AT)
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            self.modified_at[name] = time.time()
+            return self.counters[name]
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl
+        }
+
+
+class SQLiteClient:
+    # the tiny subset of the Redis API the shared backend needs (get, set with ex, incr),
+    # stored in a SQLite file so every gunicorn worker on the machine sees the same data
+
+    def __init__(self, path, max_size=CACHE_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.local = threading.local()
+        self.writes = 0
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+        )
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self.connection().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, key, value, ex=None, nx=False):
+        # nx: only when the key is missing (or expired), True if it was written, like redis
+        connection = self.connection()
+        expires = time.time() + ex if ex else None
+        if nx:
+            written = connection.execute(
+                "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+                "WHERE cache.expires IS NOT NULL AND cache.expires <= ?",
+                (key, value, expires, time.time())
+            ).rowcount > 0
+            return written or None
+        connection.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", (key, value, expires))
+        self.writes += 1
+        if self.writes % 100 == 0:
+            # expired entries go first, then the ones closer to expire until the size fits
+            connection.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+            connection.execute(
+                "DELETE FROM cache WHERE expires IS NOT NULL AND key NOT IN "
+                "(SELECT key FROM cache WHERE expires IS NOT NULL ORDER BY expires DESC LIMIT ?)",
+                (self.max_size,)
+            )
+
+    def incr(self, key):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT INTO cache (key, value, expires) VALUES (?, '1', NULL) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                (key,)
+            )
+            value = connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()[0]
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return int(value)
+
+
+class SharedBackend:
+    # works with any Redis-compatible client: redis.Redis or the local SQLiteClient stand-in
+
+    def __init__(self, client, ttl=CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # workers starting together race for it: only the first set wins and everyone reads that one
+        self.client.set("epoch", uuid.uuid4().hex[:8], nx=True)
+        self.epoch = client.get("epoch")
+        if isinstance(self.epoch, bytes):
+            self.epoch = self.epoch.decode()
+
+    def get(self, key):
+        value = self.client.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(key, json.dumps(value), ex=int(self.ttl))
+
+    def get_bytes(self, key):
+        value = self.get(key)
+        return base64.b64decode(value) if value is not None else None
+
+    def set_bytes(self, key, value):
+        self.set(key, base64.b64encode(value).decode())
+
+    def version(self, name):
+        return int(self.client.get(f"version:{name}") or 0)
+
+    def modified(self, name):
+        return float(self.client.get(f"modified:{name}") or STARTED_AT)
+
+    def incr(self, name):
+        self.client.set(f"modified:{name}", time.time())
+        return self.client.incr(f"version:{name}")
+
+    def stats(self):
+        return {
+            "backend": type(self.client).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl": self.ttl
+        }
+
+
+def get_backend(name=CACHE_BACKEND, url=CACHE_URL):
+    if name == 'redis':
+        import redis
+        return SharedBackend(redis.Redis.from_url(url))
+    if name == 'sqlite':
+        return SharedBackend(SQLiteClient(url.replace('sqlite:///', '', 1)))
+    return MemoryBackend()
+
+
+cache = get_backend()
+
+
+# Model names whose versions are also kept in the database (one row per "Model" and
+# "Model:<user_id>", written with the sync clock) and function(names) -> statement reading
+# (name, version, updated_at) for them, registered by sync.py. The memory backend only counts
+# the writes of its own process, so it reads those instead; the shared backends' counters
+# already see every worker and no query is needed.
+versioned = set()
+versions_statement = None
+# coroutine function(statement) -> rows, how the async views run it (aio.py)
+async_reader = None
+
+
+def read_versions_with(models, statement):
+    global versions_statement
+    versioned.update(models)
+    versions_statement = statement
+
+
+def read_async_with(reader):
+    global async_reader
+    async_reader = reader
+
+
+def from_database(name):
+    return isinstance(cache, MemoryBackend) and name.partition(':')[0] in versioned
+
+
+def stored(names, rows):
+    # {name: (version, modified)}, a name nobody wrote yet is at version 0
+    found = {name: (version, calendar.timegm(modified.utctimetuple()) if modified else 0) for name, version, modified in rows}
+    return {name: found.get(name, (0, 0)) for name in names}
+
+
+def fetch(names):
+    # the database versions of the request, all the missing ones in one query
+    known = g.setdefault('versions', {})
+    missing = [name for name in dict.fromkeys(names) if from_database(name) and name not in known]
+    if missing:
+        session = current_app.extensions['sqlalchemy'].session
+        known.update(stored(missing, session.execute(versions_statement(missing)).all()))
+    return known
+
+
+async def fetch_async(names):
+    # the same through the async engine, for the async views
+    known = g.setdefault('versions', {})
+    missing = [name for name in dict.fromkeys(names) if from_database(name) and name not in known]
+    if missing:
+        known.update(stored(missing, await async_reader(versions_statement(missing))))
+    return known
+
+
+def state(name):
+    # (version, modified) of "Model" or "Model:<user_id>"
+    if not from_database(name):
+        return cache.version(name), cache.modified(name)
+    return fetch([name])[name]
+
+
+def version(name):
+    return state(name)[0]
+
+
+def cached(key, loader):
+    # loader() only runs on a miss, None (not found) is never stored.
+    # The key is kept in g so the compressed response can be cached under it too.
+    g.cache_key = key
+    value = cache.get(key)
+    if value is None:
+        value = loader()
+        if value is not None:
+            cache.set(key, value)
+    return value
+
+
+def cached_row(model, row_id):
+    # serialized row or None when it doesn't exist
+    def load():
+        row = model.query.filter_by(id = row_id).first()
+        return row.serialize() if row is not None else None
+    return cached(row_key(model, row_id), load)
+
+
+async def cached_async(key, loader):
+    # same as cached() for the async views, loader() is a coroutine function
+    g.cache_key = key
+    value = cache.get(key)
+    if value is None:
+        value = await loader()
+        if value is not None:
+            cache.set(key, value)
+    return value
+
+
+def row_key(model, row_id):
+    return f"{model.__name__}:{version(model.__name__)}:{row_id}"
+
+
+def list_key(model):
+    # list pages are keyed by their query string, so every filter/sort/cursor combination is its own entry
+    args = json.dumps(sorted(request.args.items(multi=True)))
+    return f"{model.__name__}:{version(model.__name__)}:list:{args}"
+
+
+def cached_list(model, loader):
+    return cached(list_key(model), loader)
+
+
+#####################################
+# Invalidacion al confirmar cambios #
+#####################################
+# Every commit bumps the version of the models it wrote (and of the slice of one user for rows
+# with a user_id), whatever wrote them: routes, jobs, /admin or the CLI. ORM writes are seen in
+# after_flush, bulk statements call mark_written() themselves. A rollback bumps nothing.
+
+def mark_written(session, model, scope=None):
+    name = model.__name__ if scope is None else f"{model.__name__}:{scope}"
+    session.info.setdefault('written', set()).add(name)
+
+
+@event.listens_for(Session, 'after_flush')
+def track_writes(session, flush_context):
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if instance in session.dirty and not session.is_modified(instance):
+            continue
+        mark_written(session, type(instance))
+        user_id = getattr(instance, 'user_id', None)
+        if user_id is not None:
+            mark_written(session, type(instance), user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def bump_versions(session):
+    for name in session.info.pop('written', ()):
+        cache.incr(name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_writes(session):
+    session.info.pop('written', None)
+
+
+def scopes_of(names, per_user):
+    return list(names) + [f"{name}:{get_jwt_identity()}" for name in per_user]
+
+
+def validators(names, per_user):
+    # (etag, last_modified, 304 response or None) from the versions only. Counters kept in this
+    # process can't see the writes of other workers, so those names get no validators at all.
+    scopes = scopes_of(names, per_user)
+    counted = [scope for scope in scopes if not from_database(scope)]
+    if counted and isinstance(cache, MemoryBackend):
+        return None, None, None
+    fetch(scopes)
+    states = [state(scope) for scope in scopes]
+    versions = "-".join(str(scope_version) for scope_version, _ in states)
+    etag = f"{cache.epoch}-{versions}" if counted else f"v{versions}"
+    last_modified = max(modified for _, modified in states)
+
+    # the compressed variants carry the encoding in their ETag
+    candidates = [etag] + [f"{etag}-{encoding}" for encoding in ('gzip', 'br')]
+    matched = next((tag for tag in candidates if request.if_none_match.contains(tag)), None)
+    if request.if_none_match:
+        not_modified = matched is not None
+    else:
+        since = request.if_modified_since
+        not_modified = since is not None and int(last_modified) <= since.timestamp()
+
+    if not not_modified:
+        return etag, last_modified, None
+    response = make_response('', 304)
+    response.set_etag(matched or etag)
+    response.last_modified = last_modified
+    return etag, last_modified, response
+
+
+def stamp(response, etag, last_modified):
+    if etag is not None and response.status_code == 200:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+    return response
+
+
+def conditional(*names, per_user=()):
+    # ETag/Last-Modified for the GET branch of a route, computed from the versions only.
+    # When the client already has the current representation the route isn't even called.
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if request.method != 'GET':
+                    return await function(*args, **kwargs)
+                if async_reader is not None:
+                    await fetch_async(scopes_of(names, per_user))
+                etag, last_modified, not_modified = validators(names, per_user)
+                if not_modified is not None:
+                    return not_modified
+                return stamp(make_response(await function(*args, **kwargs)), etag, last_modified)
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return function(*args, **kwargs)
+            etag, last_modified, not_modified = validators(names, per_user)
+            if not_modified is not None:
+                return not_modified
+            return stamp(make_response(function(*args, **kwargs)), etag, last_modified)
+        return wrapper
+    return decorator
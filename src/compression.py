@@ -0,0 +1,95 @@
+"""
+gzip/brotli response compression negotiated with Accept-Encoding. Responses built from
+cached catalogue data keep their compressed bytes in the cache, so a hot page is only
+compressed once per version. Streamed responses (the exports) are gzipped chunk by chunk
+as they are generated.
+"""
+import os
+import gzip
+import zlib
+from flask import request, g
+from cache import cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/html')
+
+ENCODINGS = (['br'] if brotli is not None else []) + ['gzip']
+
+
+def negotiate():
+    # best encoding the client accepts, None for identity
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_LEVEL)
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+
+def gzip_stream(chunks):
+    # one gzip member written while the chunks arrive, nothing is held but the compressor state
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # the export generator holds a database cursor and the request context
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def encoded(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    # a strong ETag has to change with the encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    if response.is_streamed:
+        # the size isn't known up front, a stream is always worth it
+        if request.accept_encodings.best_match(['gzip']) is None:
+            return response
+        response.response = gzip_stream(response.response)
+        response.headers.pop('Content-Length', None)
+        return encoded(response, 'gzip')
+
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    # g.cache_key is set when the body was built from cached data, so it is the same for the same key
+    cache_key = g.get('cache_key')
+    compressed = cache.get_bytes(f"{cache_key}:{encoding}") if cache_key else None
+    if compressed is None:
+        compressed = compress(body, encoding)
+        if cache_key:
+            cache.set_bytes(f"{cache_key}:{encoding}", compressed)
+
+    response.set_data(compressed)
+    return encoded(response, encoding)
+
+
+def setup_compression(app):
+    app.after_request(compress_response)
@@ -0,0 +1,339 @@
+"""
+Change feed: every commit that writes People, Planets or Favorites publishes its changes
+through a broker, and /events streams them to the dashboards as server-sent events instead
+of having them poll the catalogue. The event id is the sync version of the change, a client
+that reconnects (Last-Event-ID) or falls behind is told to catch up with /sync?since=<id>.
+Favorites events only go to the user they belong to.
+"""
+import os
+import json
+import time
+import queue
+import sqlite3
+import asyncio
+import threading
+from flask import request
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from sqlalchemy import event
+from models import People, Planets, Favorites, Tombstone, pending_changes
+from replicas import RoutingSession
+from utils import APIException
+
+# memory | sqlite | redis
+EVENTS_BROKER = os.environ.get('EVENTS_BROKER', 'memory')
+EVENTS_URL = os.environ.get('EVENTS_URL', 'sqlite:////tmp/star-wars-api-events.db')
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 1000))
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.2))
+# how long the sqlite broker keeps published events around
+EVENTS_RETENTION = float(os.environ.get('EVENTS_RETENTION', 60))
+EVENTS_CHANNEL = 'star-wars-api:events'
+# no caching and no proxy buffering, every event has to get out right away
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# model name -> event type, the same names /sync uses
+TYPES = {model.__name__: model.__tablename__ for model in (People, Planets, Favorites)}
+
+
+###############################
+# Cambios de cada transaccion #
+###############################
+# The changes of a transaction wait in session.info until the commit, a rollback drops them.
+# after_flush still sees the pre-flush state (new, dirty and the attribute history) with the
+# ids and versions already set, the deletes come from the tombstones sync.py adds.
+
+def change(kind, action, row_id, version, user_id=None):
+    return {"type": TYPES[kind], "action": action, "id": row_id, "version": version, "user_id": user_id}
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def capture(session, flush_context):
+    pending = []
+    for instance in session.new:
+        if type(instance).__name__ in TYPES:
+            pending.append(change(type(instance).__name__, "created", instance.id, instance.version, getattr(instance, 'user_id', None)))
+        elif isinstance(instance, Tombstone):
+            pending.append(change(instance.model, "deleted", instance.row_id, instance.version, instance.user_id))
+    for instance in session.dirty:
+        if type(instance).__name__ in TYPES and session.is_modified(instance):
+            pending.append(change(type(instance).__name__, "updated", instance.id, instance.version, getattr(instance, 'user_id', None)))
+    if pending:
+        pending_changes(session).extend(pending)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def publish_changes(session):
+    changes = session.info.pop('changes', None)
+    if changes:
+        broker.publish(sorted(changes, key=lambda item: item["version"]))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def discard_changes(session):
+    session.info.pop('changes', None)
+
+
+################
+# Suscriptores #
+################
+class Subscriber:
+    # one /events connection: the changes it may see wait in a bounded queue, a client that
+    # falls behind loses them and gets a resync event instead
+
+    def __init__(self, user_id, types):
+        self.user_id = user_id
+        self.types = types
+        self.queue = queue.Queue(EVENTS_QUEUE_SIZE)
+        self.lagging = False
+
+    def wants(self, item):
+        return item["type"] in self.types and (item["type"] != 'favorites' or str(item["user_id"]) == str(self.user_id))
+
+    def offer(self, changes):
+        # called by the broker, must never block
+        for item in changes:
+            if self.wants(item):
+                self.put(item)
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.lagging = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def catch_up(self):
+        # True once after the queue overflowed, what was queued is dropped
+        if not self.lagging:
+            return False
+        self.lagging = False
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        return True
+
+
+class AsyncSubscriber(Subscriber):
+    # the same for an async view, the changes are handed over to its event loop
+
+    def __init__(self, user_id, types, loop):
+        Subscriber.__init__(self, user_id, types)
+        self.loop = loop
+        self.queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+
+    def offer(self, changes):
+        wanted = [item for item in changes if self.wants(item)]
+        if wanted:
+            self.loop.call_soon_threadsafe(self.put_all, wanted)
+
+    def put_all(self, wanted):
+        for item in wanted:
+            self.put(item)
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.lagging = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+###########
+# Brokers #
+###########
+# Every broker exposes subscribe/unsubscribe/publish. The memory one fans out inside the
+# process, the others carry the changes between the gunicorn workers and fan out locally.
+
+class MemoryBroker:
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.add(subscriber)
+        self.start()
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def start(self):
+        pass
+
+    def publish(self, changes):
+        self.deliver(changes)
+
+    def deliver(self, changes):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(changes)
+
+
+class SQLiteBroker(MemoryBroker):
+    # local stand-in for a real broker: the changes are appended to a SQLite file that every
+    # worker on the machine polls, the poller starts with the first subscriber
+
+    def __init__(self, path):
+        MemoryBroker.__init__(self)
+        self.path = path
+        self.local = threading.local()
+        self.poller = None
+        self.writes = 0
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, changes TEXT NOT NULL, created REAL NOT NULL)"
+        )
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    def publish(self, changes):
+        connection = self.connection()
+        connection.execute("INSERT INTO events (changes, created) VALUES (?, ?)", (json.dumps(changes), time.time()))
+        self.writes += 1
+        if self.writes % 100 == 0:
+            connection.execute("DELETE FROM events WHERE created < ?", (time.time() - EVENTS_RETENTION,))
+
+    def start(self):
+        with self.lock:
+            if self.poller is not None:
+                return
+            self.poller = threading.Thread(target=self.poll, name="events-poller", daemon=True)
+        self.poller.start()
+
+    def poll(self):
+        connection = self.connection()
+        last = connection.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        while True:
+            time.sleep(EVENTS_POLL_INTERVAL)
+            try:
+                rows = connection.execute("SELECT id, changes FROM events WHERE id > ? ORDER BY id", (last,)).fetchall()
+            except sqlite3.Error:
+                continue
+            for row_id, changes in rows:
+                last = row_id
+                self.deliver(json.loads(changes))
+
+
+class RedisBroker(MemoryBroker):
+    # Redis pub/sub, one listener thread per process
+
+    def __init__(self, client):
+        MemoryBroker.__init__(self)
+        self.client = client
+        self.listener = None
+
+    def publish(self, changes):
+        self.client.publish(EVENTS_CHANNEL, json.dumps(changes))
+
+    def start(self):
+        with self.lock:
+            if self.listener is not None:
+                return
+            self.listener = threading.Thread(target=self.listen, name="events-listener", daemon=True)
+        self.listener.start()
+
+    def listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(EVENTS_CHANNEL)
+        for message in pubsub.listen():
+            self.deliver(json.loads(message['data']))
+
+
+def get_broker(name=EVENTS_BROKER, url=EVENTS_URL):
+    if name == 'redis':
+        import redis
+        return RedisBroker(redis.Redis.from_url(url))
+    if name == 'sqlite':
+        return SQLiteBroker(url.replace('sqlite:///', '', 1))
+    return MemoryBroker()
+
+
+broker = get_broker()
+
+
+################
+# Flujo de SSE #
+################
+def message(event_type, data, event_id=None):
+    lines = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{lines}event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def subscription():
+    # (user_id, types, last event id) of the request, favorites need a token
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+    types = request.args.get('types', 'people,planets,favorites').split(',')
+    unknown = [name for name in types if name not in TYPES.values()]
+    if unknown:
+        raise APIException(f"types must be one of {', '.join(TYPES.values())}", status_code=400)
+    if user_id is None:
+        types = [name for name in types if name != 'favorites']
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        raise APIException("Last-Event-ID must be a sync version", status_code=400)
+    return user_id, set(types), last_id
+
+
+def opening(last_id):
+    # the reconnection delay, and a resync if the client missed events while away
+    yield f"retry: {int(EVENTS_HEARTBEAT * 1000)}\n\n"
+    if last_id:
+        yield message("resync", {"since": last_id})
+
+
+def stream(user_id, types, last_id):
+    subscriber = Subscriber(user_id, types)
+    broker.subscribe(subscriber)
+    try:
+        yield from opening(last_id)
+        while True:
+            item = subscriber.get(EVENTS_HEARTBEAT)
+            if subscriber.catch_up():
+                yield message("resync", {"since": last_id})
+            elif item is None:
+                # a comment line, keeps proxies from closing the idle connection
+                yield ": keepalive\n\n"
+            else:
+                last_id = item["version"]
+                yield message(item["type"], item, last_id)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+async def stream_async(user_id, types, last_id):
+    subscriber = AsyncSubscriber(user_id, types, asyncio.get_running_loop())
+    broker.subscribe(subscriber)
+    try:
+        for line in opening(last_id):
+            yield line
+        while True:
+            item = await subscriber.get(EVENTS_HEARTBEAT)
+            if subscriber.catch_up():
+                yield message("resync", {"since": last_id})
+            elif item is None:
+                yield ": keepalive\n\n"
+            else:
+                last_id = item["version"]
+                yield message(item["type"], item, last_id)
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,217 @@
+"""
+Background jobs for seeding: the population endpoints store a Job row and answer right away,
+a pool of worker threads (JOB_WORKERS per process) claims the queued jobs and runs them.
+The job table is the queue, so any worker process can pick a job up and every process sees
+the same progress. At most JOB_MAX_RUNNING jobs run at once across all the workers (best effort,
+two processes can race for the last slot) and never two of the same resource, they would
+fight over its checkpoint. A running job that stops sending heartbeats for JOB_STALE_SECONDS
+(its process died) goes back to the queue, crawls resume from their checkpoint.
+"""
+import os
+import json
+import time
+import socket
+import threading
+from datetime import datetime, timedelta
+from flask import request, g
+from models import db, Job, Checkpoint, People, Planets, upsert
+from swapi import get_source, swapi_id
+from utils import APIException
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_RUNNING = int(os.environ.get('JOB_MAX_RUNNING', 2))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 300))
+
+MODELS = {'planets': Planets, 'people': People}
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+# set on submit so an idle worker doesn't wait for the next poll
+wake = threading.Event()
+workers = []
+lock = threading.Lock()
+# time.monotonic() of the last requeue_stale() of this process
+last_requeue = None
+
+
+class Cancelled(Exception):
+    pass
+
+
+def now():
+    return datetime.utcnow()
+
+
+####################
+# Cola de trabajos #
+####################
+def submit(kind, resource, params):
+    job = Job(kind=kind, resource=resource, params=json.dumps(params), status='queued', cancel_requested=False,
+              pages=0, items=0, written=0, fetch_ms=0, insert_ms=0, created_at=now())
+    db.session.add(job)
+    db.session.commit()
+    wake.set()
+    return job
+
+
+def cancel(job):
+    # a queued job is cancelled right away, a running one stops before its next page
+    if job.status in FINISHED:
+        raise APIException(f"Job {job.id} already {job.status}", status_code=409)
+    cancelled = Job.query.filter_by(id=job.id, status='queued').update(
+        {"status": "cancelled", "cancel_requested": True, "finished_at": now()}, synchronize_session=False)
+    if not cancelled:
+        Job.query.filter_by(id=job.id).update({"cancel_requested": True}, synchronize_session=False)
+    db.session.commit()
+    db.session.refresh(job)
+    return job
+
+
+def requeue_stale():
+    # running jobs whose worker is gone: back to the queue, or cancelled if that was asked for.
+    # A job needs JOB_STALE_SECONDS to go stale, so the workers of a process check every half of that
+    global last_requeue
+    with lock:
+        if last_requeue is not None and time.monotonic() - last_requeue < JOB_STALE_SECONDS / 2:
+            return
+        last_requeue = time.monotonic()
+    limit = now() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = Job.query.filter(Job.status == 'running', Job.heartbeat_at < limit)
+    stale.filter_by(cancel_requested=True).update({"status": "cancelled", "finished_at": now()}, synchronize_session=False)
+    stale.update({"status": "queued", "worker": None}, synchronize_session=False)
+    db.session.commit()
+
+
+def claim(worker):
+    # the oldest queued job of a resource nobody is working on, the conditional
+    # UPDATE makes sure only one worker gets it
+    busy = [resource for resource, in db.session.query(Job.resource).filter_by(status='running')]
+    if len(busy) >= JOB_MAX_RUNNING:
+        return None
+    job = Job.query.filter(Job.status == 'queued', Job.resource.notin_(busy)).order_by(Job.id).first()
+    if job is None:
+        return None
+    claimed = Job.query.filter_by(id=job.id, status='queued').update(
+        {"status": "running", "worker": worker, "started_at": now(), "heartbeat_at": now()}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return None
+    db.session.refresh(job)
+    return job
+
+
+def progress(job, pages, items, written, fetch_s, insert_s):
+    # committed with the rows of the page, raises Cancelled if a cancel arrived meanwhile
+    job.pages += pages
+    job.items += items
+    job.written += written
+    job.fetch_ms += fetch_s * 1000
+    job.insert_ms += insert_s * 1000
+    job.heartbeat_at = now()
+    db.session.commit()
+    db.session.refresh(job)
+    if job.cancel_requested:
+        raise Cancelled()
+
+
+###########################
+# Ejecucion de un trabajo #
+###########################
+def run_page(job, model, params):
+    started = time.perf_counter()
+    details = get_source(params.get('source')).page(job.resource, concurrency=params.get('concurrency'))
+    fetched = time.perf_counter()
+    written = upsert(model, details)
+    progress(job, 1, len(details), written, fetched - started, time.perf_counter() - fetched)
+
+
+def run_crawl(job, model, params):
+    checkpoint = Checkpoint.get(job.resource)
+
+    # a finished crawl (or restart) starts over, an interrupted one resumes
+    if checkpoint.completed or params.get('restart'):
+        checkpoint.last_page = 0
+        checkpoint.last_id = None
+        checkpoint.completed = False
+        # a requeued job resumes instead of restarting again
+        params.pop('restart', None)
+        job.params = json.dumps(params)
+    db.session.commit()
+
+    # the pages are fetched while the loop asks for them, the wait for each one is its fetch time
+    started = time.perf_counter()
+    for page, details in get_source(params.get('source')).pages(job.resource, checkpoint.last_page + 1, params.get('concurrency')):
+        # the checkpoint and the progress are committed in the same transaction as the page rows,
+        # a page that fails to store rolls the checkpoint back to the last good page and fails the job
+        fetched = time.perf_counter()
+        checkpoint.last_page = page
+        if details:
+            checkpoint.last_id = swapi_id(details[-1]['url'])
+        written = upsert(model, details)
+        progress(job, 1, len(details), written, fetched - started, time.perf_counter() - fetched)
+        started = time.perf_counter()
+
+    checkpoint.completed = True
+    db.session.commit()
+
+
+def run(job):
+    model = MODELS[job.resource]
+    params = json.loads(job.params)
+    try:
+        if job.cancel_requested:
+            raise Cancelled()
+        if job.kind == 'crawl':
+            run_crawl(job, model, params)
+        else:
+            run_page(job, model, params)
+        job.status = 'succeeded'
+    except Cancelled:
+        job.status = 'cancelled'
+    except Exception as error:
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = f"{type(error).__name__}: {error}"
+    job.finished_at = now()
+    job.heartbeat_at = job.finished_at
+    db.session.commit()
+
+
+def work(app, name):
+    while True:
+        job = None
+        try:
+            with app.app_context():
+                requeue_stale()
+                job = claim(name)
+                if job is not None:
+                    run(job)
+        except Exception as error:
+            app.logger.exception(f"Job worker {name} failed: {error}")
+        # straight to the next job after one finishes, otherwise wait for a submit or the poll
+        if job is None:
+            wake.wait(JOB_POLL_INTERVAL)
+            wake.clear()
+
+
+def start_workers(app):
+    # threads start on the first request, not at import, so the CLI and the
+    # gunicorn master (before the fork) don't run jobs
+    with lock:
+        if workers:
+            return
+        for index in range(JOB_WORKERS):
+            name = f"{socket.gethostname()}:{os.getpid()}:{index}"
+            worker = threading.Thread(target=work, args=(app, name), name=f"job-worker-{index}", daemon=True)
+            worker.start()
+            workers.append(worker)
+
+
+def setup_jobs(app):
+    @app.before_request
+    def ensure_workers():
+        if not workers and JOB_WORKERS > 0:
+            start_workers(app)
+        # job status changes outside of any request, replicas could show an old one
+        if request.path.startswith('/jobs'):
+            g.read_primary = True
@@ -2,27 +2,47 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-import requests
-from flask import Flask, request, jsonify, url_for
+from flask import Flask, Response, request, jsonify, url_for, stream_with_context
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from utils import APIException, generate_sitemap, paginate, list_rows
 from admin import setup_admin
+from compression import setup_compression
+from pool import engine_options, pool_metrics
+from metrics import setup_metrics, render_metrics
+from profiler import setup_profiler
+from search import search
+from replicas import setup_replicas, replica_binds
+from jobs import setup_jobs, submit, cancel
+from sync import setup_sync, changes
+from events import subscription, stream, SSE_HEADERS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from models import db, User, Favorites, People, Planets
+from models import db, User, Favorites, People, Planets, Job
+from cache import cache, cached_row, cached_list, conditional
+from serializers import FastJSONProvider, dumps, columns
+from batch import batch_items, create_many, update_many, delete_many, create_favorites, update_favorites, delete_favorites
 #from models import Person
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.url_map.strict_slashes = False
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_BINDS'] = replica_binds()
 app.config['JWT_SECRET_KEY'] = os.environ.get('FLASK_APP_KEY')
 jwt = JWTManager(app)
 MIGRATE = Migrate(app, db)
 db.init_app(app)
 CORS(app)
 setup_admin(app)
+setup_metrics(app)
+setup_profiler(app)
+setup_replicas(app)
+setup_jobs(app)
+setup_sync(app)
+setup_compression(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -34,49 +54,65 @@ def handle_invalid_usage(error):
 def sitemap():
     return generate_sitemap(app)
 
-####################
-# URL reutilizable #
-####################
-URL_BASE = "https://swapi.dev/api"
+###########################
+# Poblar la base de datos #
+###########################
+# Seeding runs as a background job (jobs.py), the response is the queued job
+def populate(kind, resource):
+    params = {
+        "source": request.args.get('source'),
+        "concurrency": request.args.get('concurrency', type=int)
+    }
+    if kind == 'crawl':
+        params["restart"] = request.args.get('restart') == 'true'
+    job = submit(kind, resource, params)
+    return jsonify(job.serialize()), 202, {"Location": url_for('handle_job', job_id=job.id)}
 
 
 @app.route('/population/planets', methods = ['POST'])
 def handle_population_planets():
-    response = requests.get(f'{URL_BASE}/planets/?page=1&limit=20')
-    response = response.json()
-    result_planets = []
-
-    for result in response['results']:
-        detail = requests.get(result['url'])
-        detail = detail.json()
-        result_planets.append(detail)
-
-    instances = []
-
-    for planet in result_planets:
-        instance = Planets.create(planet)
-        instances.append(instance)
-
-    return jsonify(list(map( lambda inst: inst.serialize(), instances))), 200
+    return populate('page', 'planets')
 
 @app.route('/population/people', methods = ['POST'])
 def handle_population_people():
-    response = requests.get(f'{URL_BASE}/people/?page=1&limit=20')
-    response = response.json()
-    result_people = []
-
-    for result in response['results']:
-        detail = requests.get(result['url'])
-        detail = detail.json()
-        result_people.append(detail)
-
-    instances = []
-
-    for character in result_people:
-        instance = People.create(character)
-        instances.append(instance)
-
-    return jsonify(list(map( lambda inst: inst.serialize(), instances))), 200
+    return populate('page', 'people')
+
+# todo el catalogo, con checkpoints: un crawl interrumpido sigue donde quedo
+@app.route('/population/planets/all', methods = ['POST'])
+def handle_population_all_planets():
+    return populate('crawl', 'planets')
+
+@app.route('/population/people/all', methods = ['POST'])
+def handle_population_all_people():
+    return populate('crawl', 'people')
+
+
+####################################
+# Estado y cancelacion de trabajos #
+####################################
+@app.route('/jobs', methods=['GET'])
+def handle_jobs():
+    query = Job.query
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    if request.args.get('resource'):
+        query = query.filter_by(resource=request.args['resource'])
+    jobs, next_cursor = paginate(query, Job, '-id')
+    return jsonify({
+        "results": [job.serialize() for job in jobs],
+        "next": next_cursor
+    }), 200
+
+@app.route('/jobs/<int:job_id>', methods=['GET', 'DELETE'])
+def handle_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({
+            "msg": "Job not found"
+        }), 404
+    if request.method == 'DELETE':
+        job = cancel(job)
+    return jsonify(job.serialize()), 200
 
 
 ###################
@@ -85,6 +121,7 @@ def handle_population_people():
 @app.route('/user', methods=['GET', 'POST'])
 @app.route('/user/<int:user_id>', methods=['GET', 'PUT', 'DELETE'])
 @jwt_required()
+@conditional('User')
 def handle_user(user_id = None):
     
     ####################################
@@ -94,12 +131,15 @@ def handle_user(user_id = None):
 
         if user_id is None:
             
-            users = User.query.all()
+            users, next_cursor = paginate(User.query, User)
             users = list(map(
                 lambda user : user.serialize(),
                 users
             ))
-            return jsonify(users), 200
+            return jsonify({
+                "results": users,
+                "next": next_cursor
+            }), 200
         else:
             user = User.query.filter_by(id = user_id).first()
             if user is not None:
@@ -186,6 +226,7 @@ def handle_user(user_id = None):
 #########################
 @app.route('/people', methods=['GET', 'POST'])
 @app.route('/people/<int:character_id>', methods=['GET', 'PUT', 'DELETE'])
+@conditional('People')
 def handle_people(character_id = None):
 
     ########################################
@@ -194,16 +235,15 @@ def handle_people(character_id = None):
     if request.method == 'GET':
         if character_id is None:
 
-            character = People.query.all()
-            character = list(map(
-                lambda character: character.serialize(),
-                character
-            ))
-            return jsonify(character), 200
+            character, next_cursor = cached_list(People, lambda: list_rows(People))
+            return jsonify({
+                "results": character,
+                "next": next_cursor
+            }), 200
         else:
-            character = People.query.filter_by(id = character_id).first()
+            character = cached_row(People, character_id)
             if character is not None:
-                return jsonify(character.serialize()), 200
+                return jsonify(character), 200
             else:
                 return jsonify({
                     "msg": "Character not found"
@@ -257,15 +297,16 @@ def handle_people(character_id = None):
             return jsonify({
                 "msg": "Something is wrong, try again"
             }), 400
+        values = People.schema.load(body, required=People.required)
         try:
-            character_update.name = body.get("name")
-            character_update.height = body.get("height")
-            character_update.mass = body.get("mass")
-            character_update.hair_color = body.get("hair_color")
-            character_update.skin_color = body.get("skin_color")
-            character_update.eye_color = body.get("eye_color")
-            character_update.birth_year = body.get("birth_year")
-            character_update.gender = body.get("gender")
+            character_update.name = values["name"]
+            character_update.height = values["height"]
+            character_update.mass = values["mass"]
+            character_update.hair_color = values["hair_color"]
+            character_update.skin_color = values["skin_color"]
+            character_update.eye_color = values["eye_color"]
+            character_update.birth_year = values["birth_year"]
+            character_update.gender = values["gender"]
             db.session.commit()
             return jsonify(character_update.serialize()), 202
         except Exception as error:
@@ -300,6 +341,7 @@ def handle_people(character_id = None):
 #######################
 @app.route('/planets', methods=['GET', 'POST'])
 @app.route('/planets/<int:planet_id>', methods=['GET', 'PUT', 'DELETE'])
+@conditional('Planets')
 def handle_planetas(planet_id = None):
 
     ##########################################
@@ -308,16 +350,15 @@ def handle_planetas(planet_id = None):
     if request.method == 'GET':
         if planet_id is None:
 
-            planets = Planets.query.all()
-            planets = list(map(
-                lambda planet : planet.serialize(),
-                planets
-            ))
-            return jsonify(planets), 200
+            planets, next_cursor = cached_list(Planets, lambda: list_rows(Planets))
+            return jsonify({
+                "results": planets,
+                "next": next_cursor
+            }), 200
         else:
-            planet = Planets.query.filter_by(id = planet_id).first()
-            if planet_id is not None:
-                return jsonify(planet.serialize()), 200
+            planet = cached_row(Planets, planet_id)
+            if planet is not None:
+                return jsonify(planet), 200
             else:
                 return jsonify({
                     "msg": "Planet not found"
@@ -369,14 +410,15 @@ def handle_planetas(planet_id = None):
             return jsonify({
                 "msg": "Something is wrong, try again"
             }), 400
+        values = Planets.schema.load(body, required=Planets.required)
         try:
-            planet_update.name = body["name"]
-            planet_update.diameter = body["diameter"]
-            planet_update.climate = body["climate"]
-            planet_update.gravity = body["gravity"]
-            planet_update.terrain = body["terrain"]
-            planet_update.surface_water = body["surface_water"]
-            planet_update.population = body["population"]
+            planet_update.name = values["name"]
+            planet_update.diameter = values["diameter"]
+            planet_update.climate = values["climate"]
+            planet_update.gravity = values["gravity"]
+            planet_update.terrain = values["terrain"]
+            planet_update.surface_water = values["surface_water"]
+            planet_update.population = values["population"]
             db.session.commit()
             return jsonify(planet_update.serialize()), 202
         except Exception as error:
@@ -406,17 +448,90 @@ def handle_planetas(planet_id = None):
             return jsonify(error.args)
 
 
+########################################
+# Escrituras en lote de people/planets #
+########################################
+def batch(model):
+    items = batch_items()
+    if request.method == 'POST':
+        result = create_many(model, items)
+    elif request.method == 'PATCH':
+        result = update_many(model, items)
+    else:
+        result = delete_many(model, items)
+
+    return jsonify(result), 200
+
+
+@app.route('/people/batch', methods = ['POST', 'PATCH', 'DELETE'])
+def handle_people_batch():
+    return batch(People)
+
+@app.route('/planets/batch', methods = ['POST', 'PATCH', 'DELETE'])
+def handle_planets_batch():
+    return batch(Planets)
+
+
+#############################
+# Exportar tablas completas #
+#############################
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+def export(model):
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'json'):
+        raise APIException("format must be ndjson or json", status_code=400)
+
+    # rows come from the database in chunks and are written out as soon as they are serialized
+    rows = db.session.query(*columns(model)).order_by(model.id).yield_per(EXPORT_CHUNK_SIZE)
+
+    def generate_ndjson():
+        for row in rows:
+            yield dumps(dict(zip(model.public, row))) + '\n'
+
+    def generate_json():
+        yield '['
+        separator = ''
+        for row in rows:
+            yield separator + dumps(dict(zip(model.public, row)))
+            separator = ','
+        yield ']'
+
+    if export_format == 'json':
+        return Response(stream_with_context(generate_json()), mimetype='application/json')
+    return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+
+@app.route('/export/people', methods = ['GET'])
+@conditional('People')
+def handle_export_people():
+    return export(People)
+
+@app.route('/export/planets', methods = ['GET'])
+@conditional('Planets')
+def handle_export_planets():
+    return export(Planets)
+
+
 ##################################
 ##### Favoritos de cada User #####
 ##################################
 @app.route('/user/favorites', methods = ['GET'])
 @jwt_required()
+@conditional('People', 'Planets', per_user=('Favorites',))
 def handle_get_favorites():
 
     #########################
     # Identity reutilizable #
     #########################
     user_id = get_jwt_identity()
+
+    ####################################################################
+    # ?embed=true trae el personaje/planeta completo en la misma query #
+    ####################################################################
+    if request.args.get('embed') == 'true':
+        favorites = Favorites.with_records(user_id)
+        return jsonify([favorite.serialize_with_record(record) for favorite, record in favorites])
     
     favorites = Favorites.query.filter_by( user_id = user_id ).all()
 
@@ -429,12 +544,31 @@ def handle_get_favorites():
   
     return jsonify(favorites_serialize)
 
+##############################
+# Favoritos del User en lote #
+##############################
+@app.route('/user/favorites/batch', methods = ['POST', 'PATCH', 'DELETE'])
+@jwt_required()
+def handle_favorites_batch():
+    user_id = get_jwt_identity()
+    items = batch_items()
+
+    if request.method == 'POST':
+        result = create_favorites(user_id, items)
+    elif request.method == 'PATCH':
+        result = update_favorites(user_id, items)
+    else:
+        result = delete_favorites(user_id, items)
+
+    return jsonify(result), 200
+
 ###############################
 # Planetas favoritos del User #
 ###############################
 @app.route('/user/favorites/planets', methods = ['GET', 'POST'])
 @app.route('/user/favorites/planets/<int:planet_id>', methods = ['GET', 'PUT', 'DELETE'])
 @jwt_required()
+@conditional(per_user=('Favorites',))
 def handle_planets_favorites( planet_id = None ):
 
     #########################
@@ -448,12 +582,8 @@ def handle_planets_favorites( planet_id = None ):
     if request.method == 'GET':
 
         if planet_id is None:
-            favorites = Favorites.query.filter_by( user_id = user_id ).all()
-            favorite_planets = []
-            
-            for favorite in favorites:
-                if favorite.nature_id is not None and favorite.nature == 'Planet':
-                    favorite_planets.append(favorite.serialize())
+            favorites = Favorites.query.filter_by( user_id = user_id, nature = 'Planet' ).all()
+            favorite_planets = [favorite.serialize() for favorite in favorites]
 
             if not favorite_planets:
                 return jsonify({
@@ -541,6 +671,7 @@ def handle_planets_favorites( planet_id = None ):
 @app.route('/user/favorites/people', methods = ['GET', 'POST'])
 @app.route('/user/favorites/people/<int:character_id>', methods = ['GET', 'PUT', 'DELETE'])
 @jwt_required()
+@conditional(per_user=('Favorites',))
 def handle_personajes_favoritos( character_id = None):
 
 
@@ -554,13 +685,8 @@ def handle_personajes_favoritos( character_id = None):
     ###################################################
     if request.method == 'GET':
         if character_id is None:
-            favorites = Favorites.query.filter_by( user_id = user_id ).all()
-
-            favorite_characters = []
-
-            for favorite in favorites:
-                if favorite.nature_id is not None and favorite.nature == 'People':
-                    favorite_characters.append(favorite.serialize())
+            favorites = Favorites.query.filter_by( user_id = user_id, nature = 'People' ).all()
+            favorite_characters = [favorite.serialize() for favorite in favorites]
 
             if not favorite_characters:
                 return jsonify({
@@ -694,6 +820,55 @@ def handle_register():
         db.session.rollback()
         return jsonify(error.args), 500
 
+#####################################
+# Busqueda de personajes y planetas #
+#####################################
+@app.route('/search', methods = ['GET'])
+@conditional('People', 'Planets')
+def handle_search():
+    return jsonify({
+        "results": search()
+    }), 200
+
+##########################################
+# Sincronizacion incremental del cliente #
+##########################################
+# ?since=<version> devuelve solo lo que cambio, los favoritos con un token
+@app.route('/sync', methods = ['GET'])
+def handle_sync():
+    return jsonify(changes()), 200
+
+########################################
+# Cambios en vivo (server-sent events) #
+########################################
+# cada conexion ocupa un hilo: el Procfile arranca gunicorn con gthread (GUNICORN_THREADS por worker),
+# el punto de entrada ASGI las atiende con una tarea cada una
+@app.route('/events', methods = ['GET'])
+def handle_events():
+    user_id, types, last_id = subscription()
+    return Response(stream(user_id, types, last_id), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+##########################
+# Estadisticas del cache #
+##########################
+@app.route('/cache/stats', methods = ['GET'])
+def handle_cache_stats():
+    return jsonify(cache.stats()), 200
+
+###########################
+# Metricas del pool de BD #
+###########################
+@app.route('/db/pool', methods = ['GET'])
+def handle_pool_metrics():
+    return jsonify(pool_metrics(db.engine)), 200
+
+######################
+# Metricas de la API #
+######################
+@app.route('/metrics', methods = ['GET'])
+def handle_metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 # this only runs if `$ python src/main.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
@@ -0,0 +1,200 @@
+"""
+Prometheus-style request metrics. Every worker keeps its own numbers in memory and a thread
+dumps them to METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds (and at exit),
+/metrics adds up the files of every worker. Clear METRICS_DIR when the app is (re)deployed,
+the files of dead workers are still counted on purpose.
+"""
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+from flask import request, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'star-wars-api-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        # something changed since the last flush
+        self.dirty = False
+        self.flusher = None
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.dirty = True
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(buckets), "sum": 0, "count": 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+            self.dirty = True
+
+    def dump(self):
+        with self.lock:
+            self.dirty = False
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, list(labels), dict(value, buckets=list(value["buckets"]))] for (name, labels), value in self.histograms.items()]
+            }
+
+    def flush(self):
+        # atomic replace, a scrape never reads half a file
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", 'w') as snapshot:
+            json.dump(self.dump(), snapshot)
+        os.replace(f"{path}.tmp", path)
+
+    def flush_changes(self):
+        if self.dirty:
+            self.flush()
+
+    def start(self):
+        # one flusher per process, started by the first request so the gunicorn
+        # master (before the fork) doesn't run one
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self.run, name="metrics-flusher", daemon=True)
+        self.flusher.start()
+        atexit.register(self.flush_changes)
+
+    def run(self):
+        # an idle worker still gets its last requests out
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush_changes()
+            except OSError:
+                pass
+
+
+registry = Registry()
+
+
+def collect():
+    # sum of the snapshots of every worker
+    counters = {}
+    histograms = {}
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as snapshot:
+                data = json.load(snapshot)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in data["histograms"]:
+            key = (name, tuple(labels))
+            total = histograms.setdefault(key, {"buckets": [0] * len(value["buckets"]), "sum": 0, "count": 0})
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], value["buckets"])]
+            total["sum"] += value["sum"]
+            total["count"] += value["count"]
+    return counters, histograms
+
+
+HELP = {
+    "http_requests_total": ("counter", "Requests by endpoint, method and status"),
+    "http_request_duration_seconds": ("histogram", "Request latency"),
+    "http_response_size_bytes": ("histogram", "Response body size"),
+    "db_queries_total": ("counter", "SQL statements run while serving requests"),
+    "db_query_duration_seconds_total": ("counter", "Time spent in SQL while serving requests"),
+}
+LABELS = {
+    "http_requests_total": ("endpoint", "method", "status"),
+}
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+def render_metrics():
+    registry.flush()
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, description) in HELP.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        names = LABELS.get(name, ("endpoint", "method"))
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(names, labels)} {value}")
+            continue
+        buckets = LATENCY_BUCKETS if name == "http_request_duration_seconds" else SIZE_BUCKETS
+        for (metric, labels), value in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(buckets + ("+Inf",), value["buckets"] + [value["count"]]):
+                le = 'le="%s"' % bound
+                lines.append(f"{name}_bucket{format_labels(names, labels, le)} {count}")
+            lines.append(f"{name}_sum{format_labels(names, labels)} {value['sum']}")
+            lines.append(f"{name}_count{format_labels(names, labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        g.query_time = g.get('query_time', 0) + elapsed
+
+
+def start_request():
+    if registry.flusher is None:
+        registry.start()
+    g.request_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    labels = (request.endpoint or 'unmatched', request.method)
+    registry.inc("http_requests_total", labels + (str(response.status_code),))
+    registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started, LATENCY_BUCKETS)
+    if response.content_length is not None:
+        registry.observe("http_response_size_bytes", labels, response.content_length, SIZE_BUCKETS)
+    registry.inc("db_queries_total", labels, g.get('query_count', 0))
+    registry.inc("db_query_duration_seconds_total", labels, g.get('query_time', 0))
+    return response
+
+
+def setup_metrics(app):
+    app.before_request(start_request)
+    # registered before compression, so after_request runs it last and sees the final size
+    app.after_request(record_request)
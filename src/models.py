@@ -1,6 +1,134 @@
+import json
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import postgresql, sqlite, mysql
+from schema import Schema, ValidationError, STAMPS
+from replicas import RoutingSession
+from cache import mark_written
+from swapi import swapi_id
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+UPSERT_BATCH_SIZE = 500
+
+
+def swapi_row(model, data):
+    # SWAPI record -> column values, None when a required value is missing or can't be cast
+    # (the record is skipped, the job counts it in items but not in written)
+    try:
+        values = model.schema.load(data, required=model.schema.required)
+    except ValidationError:
+        return None
+    row = {name: values.get(name) for name in model.schema.columns}
+    row["swapi_id"] = swapi_id(data["url"])
+    return row
+
+
+def upsert_statement(model, rows, dialect):
+    # INSERT ... ON CONFLICT (swapi_id) DO UPDATE, only for the rows whose values really changed
+    columns = [column.name for column in model.__table__.columns if not column.primary_key and column.name != 'swapi_id']
+    # the sync stamps always differ, they are written but don't count as a change
+    compared = [name for name in columns if name not in STAMPS]
+
+    if dialect == 'mysql':
+        # no WHERE here: the stamps keep their old value when nothing else changed. MySQL assigns
+        # left to right, so they go first, while the other columns still hold the stored values
+        statement = mysql.insert(model).values(rows)
+        unchanged = db.and_(*[getattr(model, name).is_not_distinct_from(statement.inserted[name]) for name in compared])
+        stamps = [(name, db.func.if_(unchanged, getattr(model, name), statement.inserted[name])) for name in STAMPS]
+        return statement.on_duplicate_key_update(stamps + [(name, statement.inserted[name]) for name in compared])
+
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    statement = insert(model).values(rows)
+    changed = db.or_(*[getattr(model, name).is_distinct_from(statement.excluded[name]) for name in compared])
+    return statement.on_conflict_do_update(
+        index_elements=['swapi_id'],
+        set_={name: statement.excluded[name] for name in columns},
+        where=changed
+    )
+
+
+def reserve(session, count, scopes=()):
+    # (first, now): versions first .. first + count - 1 of the global sync clock. The UPDATE locks
+    # the clock row until the commit, so versions become visible in the order they were handed out.
+    # `scopes` ("Model" or "Model:<user_id>") are the slices written, they move to the last version
+    clock = SyncClock.__table__
+    connection = session.connection()
+    bumped = connection.execute(clock.update().where(clock.c.id == 1).values(version=clock.c.version + count))
+    if bumped.rowcount == 0:
+        connection.execute(clock.insert().values(id=1, version=count))
+    last = connection.execute(db.select(clock.c.version).where(clock.c.id == 1)).scalar()
+    now = datetime.utcnow()
+    touch(session, scopes, last, now)
+    return last - count + 1, now
+
+
+def touch(session, scopes, version, now):
+    # one row per scope with its newest version, what the ETags and cache keys read with the
+    # memory backend. Only called with the clock row locked, so two writers never race here
+    table = ScopeVersion.__table__
+    connection = session.connection()
+    for scope in scopes:
+        updated = connection.execute(table.update().where(table.c.scope == scope).values(version=version, updated_at=now))
+        if updated.rowcount == 0:
+            connection.execute(table.insert().values(scope=scope, version=version, updated_at=now))
+
+
+def pending_changes(session):
+    # change events of the open transaction, events.py publishes them after the commit
+    return session.info.setdefault('changes', [])
+
+
+def upsert(model, records, session=None):
+    # idempotent seed: one statement per batch keyed on the SWAPI id, returns how many rows were written.
+    # `session` is the Flask-SQLAlchemy one unless given, a database error rolls back and is re-raised
+    session = session or db.session
+    rows = {}
+    for data in records:
+        row = swapi_row(model, data)
+        if row is not None:
+            rows[row["swapi_id"]] = row
+    rows = list(rows.values())
+
+    try:
+        if rows:
+            # one sync version per row, reserved before the writes so the clock row is held to the commit
+            first, stamped_at = reserve(session, len(rows))
+            for offset, row in enumerate(rows):
+                row["version"] = first + offset
+                row["updated_at"] = stamped_at
+
+        if 'name' in model.unique and rows:
+            # rows stored before swapi_id existed are claimed by their unique name
+            table = model.__table__
+            session.execute(
+                table.update().where(table.c.name == db.bindparam('b_name'), table.c.swapi_id.is_(None))
+                .values(swapi_id=db.bindparam('b_swapi_id')),
+                [{"b_name": row["name"], "b_swapi_id": row["swapi_id"]} for row in rows]
+            )
+
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            session.execute(upsert_statement(model, rows[start:start + UPSERT_BATCH_SIZE], session.get_bind().dialect.name))
+        # the rows written are the ones that kept their new version, the rowcount of an upsert
+        # means something else on every database (MySQL counts an update twice)
+        written = 0
+        if rows:
+            written = session.query(db.func.count(model.id)).filter(model.version.between(first, first + len(rows) - 1)).scalar()
+        if written:
+            touch(session, [model.__name__], first + len(rows) - 1, stamped_at)
+            mark_written(session, model)
+            # which rows really changed isn't known, one event covers the whole seed
+            pending_changes(session).append({
+                "type": model.__tablename__, "action": "bulk", "id": None,
+                "version": first + len(rows) - 1, "user_id": None, "written": written
+            })
+        session.commit()
+        return written
+    except Exception:
+        # nothing of the batch is kept, the caller decides what a failed page means
+        session.rollback()
+        raise
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -27,11 +155,17 @@ class Favorites(db.Model):
     name = db.Column(db.String(60), nullable=False)
     nature = db.Column(db.String(50), nullable=False)
     nature_id = db.Column(db.Integer, nullable=False)
+    # stamped by sync.py on every write, /sync reads the changes of a user by (user_id, version)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
     __table_args__ = (db.UniqueConstraint(
     'user_id',
     'name',
     name="dont_repeat_favorites"
-    ),)
+    ),
+    # every favorites GET, PUT and DELETE filters by these three columns
+    db.Index('ix_favorites_user_nature', 'user_id', 'nature', 'nature_id'),
+    db.Index('ix_favorites_user_version', 'user_id', 'version'),)
 
     def __repr__(self):
         return f"<Favorites object {self.id}>"
@@ -44,18 +178,57 @@ class Favorites(db.Model):
             "nature_id": self.nature_id
         }
 
+    def serialize_with_record(self, record):
+        favorite = self.serialize()
+        favorite["record"] = record.serialize() if record is not None else None
+        return favorite
+
+    @classmethod
+    def records_statement(cls, user_id):
+        # favorites of the user with their People/Planets row, both joins resolved in a single query
+        return db.select(cls, People, Planets).filter(cls.user_id == user_id).outerjoin(
+            People, db.and_(cls.nature == 'People', People.id == cls.nature_id)
+        ).outerjoin(
+            Planets, db.and_(cls.nature == 'Planet', Planets.id == cls.nature_id)
+        ).order_by(cls.id)
+
+    @staticmethod
+    def pair_records(rows):
+        return [(favorite, character or planet) for favorite, character, planet in rows]
+
+    @classmethod
+    def with_records(cls, user_id):
+        # (favorite, People or Planets instance) pairs
+        return cls.pair_records(db.session.execute(cls.records_statement(user_id)).all())
+
 
 class People(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    swapi_id = db.Column(db.Integer)
 
-    name = db.Column(db.String(50), nullable=False)
+    name = db.Column(db.String(50), nullable=False, index=True)
     height = db.Column(db.Integer, nullable=False)
     mass = db.Column(db.Integer, nullable=False)
-    hair_color = db.Column(db.String(50), nullable=False)
-    skin_color = db.Column(db.String(50), nullable=False)
-    eye_color = db.Column(db.String(50), nullable=False)
+    hair_color = db.Column(db.String(50), nullable=False, index=True)
+    skin_color = db.Column(db.String(50), nullable=False, index=True)
+    eye_color = db.Column(db.String(50), nullable=False, index=True)
     birth_year = db.Column(db.String(50), nullable=False)
-    gender = db.Column(db.String(50), nullable=False)
+    gender = db.Column(db.String(50), nullable=False, index=True)
+    # stamped by sync.py on every write
+    version = db.Column(db.BigInteger, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime)
+
+    # columns the list endpoint can filter and sort by, all of them indexed
+    filterable = ('name', 'hair_color', 'skin_color', 'eye_color', 'gender')
+    sortable = ('id',) + filterable
+    # columns a POST must send, unique ones are checked before a batch insert
+    required = ('name', 'height', 'mass', 'hair_color', 'skin_color', 'eye_color', 'birth_year', 'gender')
+    # what serialize() returns, used to render rows straight from column tuples
+    public = ('id',) + required
+    unique = ()
+    __table_args__ = (db.UniqueConstraint('swapi_id', name="uq_people_swapi_id"),
+    # /search on PostgreSQL, SQLite uses the FTS5 table of name_search_ddl() and MySQL the name index
+    db.Index('ix_people_name_trgm', 'name', postgresql_using='gist', postgresql_ops={'name': 'gist_trgm_ops'}).ddl_if(dialect='postgresql'),)
 
 
     def __repr__(self):
@@ -74,49 +247,42 @@ class People(db.Model):
             "gender": self.gender
         }
 
-    def __init__(self, *args, **kwargs):
-
-        for (key, value) in kwargs.items():
-            if hasattr(self, key):
-                attr_type = getattr(self.__class__, key).type
-
-                try:
-                    attr_type.python_type(value)
-                    setattr(self, key, value)
-                except Exception as error:
-                    print(f"ignore the other values: {error.args}")
-
-    @classmethod
-    def create(cls, data):
-        instance = cls(**data)
-        if (not isinstance(instance, cls)):
-            print("Something failed")
-            return None
-        db.session.add(instance)
-        try:
-            db.session.commit()
-            print(f"Created: {instance.name}")
-            return instance
-        except Exception as error:
-            db.session.rollback()
-            print(error.args)
+    def __init__(self, **kwargs):
+        # coerced by the compiled schema, raises ValidationError on bad values
+        for (key, value) in self.schema.load(kwargs).items():
+            setattr(self, key, value)
 
 
 class Planets(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    swapi_id = db.Column(db.Integer)
 
     name = db.Column(db.String(50), unique=True, nullable=False)
     diameter = db.Column(db.Float, nullable=False)
-    climate = db.Column(db.String(50), nullable=False)
-    gravity = db.Column(db.String(50), nullable=False)
-    terrain = db.Column(db.String(50), nullable=False)
+    climate = db.Column(db.String(50), nullable=False, index=True)
+    gravity = db.Column(db.String(50), nullable=False, index=True)
+    terrain = db.Column(db.String(50), nullable=False, index=True)
     surface_water = db.Column(db.String(50), nullable=False)
     population = db.Column(db.String(100))
+    # stamped by sync.py on every write
+    version = db.Column(db.BigInteger, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime)
+
+    # columns the list endpoint can filter and sort by, all of them indexed
+    filterable = ('name', 'climate', 'gravity', 'terrain')
+    sortable = ('id',) + filterable
+    # columns a POST must send, unique ones are checked before a batch insert
+    required = ('name', 'diameter', 'climate', 'gravity', 'terrain', 'surface_water', 'population')
+    # what serialize() returns, used to render rows straight from column tuples
+    public = ('id',) + required
+    unique = ('name',)
     __table_args__ = (db.UniqueConstraint(
     'diameter',
     'name',
     name="dont_repeat_planets"
-    ),)
+    ),
+    db.UniqueConstraint('swapi_id', name="uq_planets_swapi_id"),
+    db.Index('ix_planets_name_trgm', 'name', postgresql_using='gist', postgresql_ops={'name': 'gist_trgm_ops'}).ddl_if(dialect='postgresql'),)
 
     
     def __repr__(self):
@@ -134,29 +300,158 @@ class Planets(db.Model):
             "population": self.population
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, **kwargs):
+        # coerced by the compiled schema, raises ValidationError on bad values
+        for (key, value) in self.schema.load(kwargs).items():
+            setattr(self, key, value)
+
+
+# compiled once, shared by the constructors, the batch endpoints and the seeding
+People.schema = Schema(People)
+Planets.schema = Schema(Planets)
+
 
-        for (key, value) in kwargs.items():
-            if hasattr(self, key):
-                attr_type = getattr(self.__class__, key).type
+def name_search_ddl(table):
+    # /search on SQLite: an FTS5 index over the words of the names, the triggers keep it
+    # in step with every write to the table
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(name, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {table}_fts (rowid, name) VALUES (new.id, new.name); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {table}_fts ({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF name ON {table} BEGIN "
+        f"INSERT INTO {table}_fts ({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        f"INSERT INTO {table}_fts (rowid, name) VALUES (new.id, new.name); END",
+    ]
+
+
+# the migrations create them too, this is for db.create_all()
+for model in (People, Planets):
+    for statement in name_search_ddl(model.__tablename__):
+        event.listen(model.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+class Checkpoint(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
 
-                try:
-                    attr_type.python_type(value)
-                    setattr(self, key, value)
-                except Exception as error:
-                    print(f"ignore the other values: {error.args}")
+    resource = db.Column(db.String(50), unique=True, nullable=False)
+    last_page = db.Column(db.Integer, nullable=False, default=0)
+    last_id = db.Column(db.Integer)
+    completed = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f"<Checkpoint {self.resource}: page {self.last_page}>"
+
+    def serialize(self):
+        return {
+            "resource": self.resource,
+            "last_page": self.last_page,
+            "last_id": self.last_id,
+            "completed": self.completed
+        }
 
     @classmethod
-    def create(cls, data):
-        instance = cls(**data)
-        if (not isinstance(instance, cls)):
-            print("Something failed")
-            return None
-        db.session.add(instance)
-        try:
-            db.session.commit()
-            print(f"Created: {instance.name}")
-            return instance
-        except Exception as error:
-            db.session.rollback()
-            print(error.args)
\ No newline at end of file
+    def get(cls, resource):
+        checkpoint = cls.query.filter_by(resource=resource).first()
+        if checkpoint is None:
+            checkpoint = cls(resource=resource, last_page=0, completed=False)
+            db.session.add(checkpoint)
+        return checkpoint
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+
+    # page: one SWAPI page, crawl: every page with the checkpoint of the resource
+    kind = db.Column(db.String(20), nullable=False)
+    resource = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    # queued -> running -> succeeded | failed | cancelled
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    pages = db.Column(db.Integer, nullable=False, default=0)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    written = db.Column(db.Integer, nullable=False, default=0)
+    # time spent fetching from SWAPI and storing the rows, summed over the pages
+    fetch_ms = db.Column(db.Float, nullable=False, default=0)
+    insert_ms = db.Column(db.Float, nullable=False, default=0)
+    error = db.Column(db.Text)
+    worker = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.resource}: {self.status}>"
+
+    def serialize(self):
+        end = self.finished_at or (self.heartbeat_at if self.status == 'running' else None)
+        elapsed = (end - self.started_at).total_seconds() if self.started_at and end else 0
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "resource": self.resource,
+            "params": json.loads(self.params),
+            "status": self.status,
+            "cancel_requested": self.cancel_requested,
+            "progress": {
+                "pages": self.pages,
+                "items": self.items,
+                "written": self.written,
+                "fetch_ms": round(self.fetch_ms, 2),
+                "insert_ms": round(self.insert_ms, 2),
+                "elapsed_s": round(elapsed, 3),
+                "items_per_s": round(self.items / elapsed, 2) if elapsed else None
+            },
+            "error": self.error,
+            "worker": self.worker,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class SyncClock(db.Model):
+    # a single row, the last version handed out to a People, Planets or Favorites write
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SyncClock {self.version}>"
+
+
+class ScopeVersion(db.Model):
+    # newest sync version of a model ("People") or of the rows of one user ("Favorites:3")
+    scope = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<ScopeVersion {self.scope} {self.version}>"
+
+
+class Tombstone(db.Model):
+    # one per deleted People, Planets or Favorites row, so /sync can report deletes
+    id = db.Column(db.Integer, primary_key=True)
+
+    model = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    # owner of a deleted favorite, None for the catalogue
+    user_id = db.Column(db.Integer)
+    version = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (
+        db.Index('ix_tombstone_model_version', 'model', 'version'),
+        db.Index('ix_tombstone_user_version', 'user_id', 'version'),
+    )
+
+    def __repr__(self):
+        return f"<Tombstone {self.model} {self.row_id}>"
+
+    def serialize(self):
+        return {
+            "id": self.row_id,
+            "version": self.version,
+            "deleted_at": self.deleted_at.isoformat()
+        }
@@ -0,0 +1,115 @@
+"""
+Database connection pool settings (read from the environment) and pool metrics
+"""
+import os
+import time
+import threading
+from sqlalchemy import exc, event
+from sqlalchemy.pool import QueuePool
+
+
+class MeteredQueuePool(QueuePool):
+    # QueuePool that keeps track of how long checkouts wait and how often the pool overflows or runs dry
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        event.listen(self, 'invalidate', self.count_invalidate)
+
+    def count_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.metrics_lock:
+            self.invalidations += 1
+
+    def _create_connection(self):
+        connection = QueuePool._create_connection(self)
+        with self.metrics_lock:
+            self.connects += 1
+        return connection
+
+    def recreate(self):
+        # called after a failover invalidates the whole pool, the counters belong to the app so they move over
+        pool = QueuePool.recreate(self)
+        for name in ('checkouts', 'overflow_checkouts', 'timeouts', 'connects', 'invalidations', 'wait_total', 'wait_max'):
+            setattr(pool, name, getattr(self, name))
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = QueuePool._do_get(self)
+        except exc.TimeoutError:
+            with self.metrics_lock:
+                self.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        with self.metrics_lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if self.overflow() > 0:
+                self.overflow_checkouts += 1
+        return connection
+
+    def metrics(self):
+        return {
+            "pid": os.getpid(),
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "max_overflow": self._max_overflow,
+            "timeout": self._timeout,
+            "checkouts": self.checkouts,
+            "overflow_checkouts": self.overflow_checkouts,
+            "timeouts": self.timeouts,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+            "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0,
+            "wait_max_ms": round(self.wait_max * 1000, 3)
+        }
+
+
+# threads of a worker that can each hold a connection at once: the request threads (gthread's in
+# the Procfile, the pool of the ASGI entry point) and the job workers
+WORKER_THREADS = (
+    max(int(os.environ.get('GUNICORN_THREADS', 32)), int(os.environ.get('ASGI_THREADS', 32)))
+    + int(os.environ.get('JOB_WORKERS', 2))
+)
+
+
+def env_flag(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def engine_options(uri):
+    # DB_POOL_* env vars -> SQLALCHEMY_ENGINE_OPTIONS, sized per gunicorn worker
+    options = {
+        "pool_pre_ping": env_flag('DB_POOL_PRE_PING', True),
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    # SQLite keeps the pool Flask-SQLAlchemy picks for it (in-memory databases need a static one)
+    if uri and not uri.startswith('sqlite'):
+        pool_size = int(os.environ.get('DB_POOL_SIZE', 5))
+        # by default the overflow covers every thread, so none of them waits DB_POOL_TIMEOUT and fails
+        max_overflow = int(os.environ.get('DB_MAX_OVERFLOW') or max(WORKER_THREADS - pool_size, 10))
+        options.update({
+            "poolclass": MeteredQueuePool,
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        })
+    return options
+
+
+def pool_metrics(engine):
+    pool = engine.pool
+    if isinstance(pool, MeteredQueuePool):
+        return pool.metrics()
+    return {"pid": os.getpid(), "pool": type(pool).__name__, "status": pool.status()}
@@ -0,0 +1,135 @@
+"""
+Opt-in profiler for a single request: cProfile stats plus every SQL statement with its duration
+and the line of our code that ran it. It runs for every request when PROFILER_ENABLED is set, or
+for one request sending the `X-Profile` header with the token of a user listed in PROFILER_ADMINS.
+The full report is written to PROFILER_DIR and a summary goes back in the `X-Profile` header.
+"""
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import traceback
+from flask import request, g, has_request_context
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from pool import env_flag
+
+PROFILER_ENABLED = env_flag('PROFILER_ENABLED', False)
+PROFILER_ADMINS = {admin.strip() for admin in os.environ.get('PROFILER_ADMINS', '').split(',') if admin.strip()}
+PROFILER_DIR = os.environ.get('PROFILER_DIR', 'profiles')
+# the same statement this many times in one request is reported as a N+1
+PROFILER_REPEATED = int(os.environ.get('PROFILER_REPEATED', 5))
+PROFILER_TOP = int(os.environ.get('PROFILER_TOP', 30))
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+
+def requested():
+    if PROFILER_ENABLED:
+        return True
+    if 'X-Profile' not in request.headers:
+        return False
+    try:
+        verify_jwt_in_request(optional=True)
+    except Exception:
+        return False
+    return str(get_jwt_identity()) in PROFILER_ADMINS
+
+
+def caller():
+    # innermost frame of the app itself, e.g. "main.py:412 handle_get_favorites"
+    for frame in reversed(traceback.extract_stack()[:-3]):
+        if frame.filename.startswith(SRC) and not frame.filename.endswith('profiler.py'):
+            return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profile' in g:
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profile' in g and conn.info.get('profile_started'):
+        g.profile["queries"].append({
+            "statement": statement,
+            "duration": time.perf_counter() - conn.info['profile_started'].pop(),
+            "executemany": executemany,
+            "caller": caller()
+        })
+
+
+def repeated(queries):
+    # statements are parametrized, so a loop of filter_by(...) calls shows up as the same text
+    groups = {}
+    for query in queries:
+        group = groups.setdefault(query["statement"], {"statement": query["statement"], "count": 0, "duration": 0, "callers": set()})
+        group["count"] += 1
+        group["duration"] += query["duration"]
+        if query["caller"]:
+            group["callers"].add(query["caller"])
+    found = [dict(group, callers=sorted(group["callers"])) for group in groups.values() if group["count"] >= PROFILER_REPEATED]
+    return sorted(found, key=lambda group: group["count"], reverse=True)
+
+
+def start_profile():
+    if not requested():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another request of this process is already being profiled
+        profiler = None
+    g.profile = {"profiler": profiler, "started": time.perf_counter(), "queries": []}
+
+
+def stats(profiler):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILER_TOP)
+    return output.getvalue()
+
+
+def end_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    elapsed = time.perf_counter() - profile["started"]
+    if profile["profiler"] is not None:
+        profile["profiler"].disable()
+
+    queries = profile["queries"]
+    report = {
+        "method": request.method,
+        "path": request.full_path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "duration": elapsed,
+        "sql": {
+            "count": len(queries),
+            "duration": sum(query["duration"] for query in queries),
+            "repeated": repeated(queries),
+            "queries": queries
+        },
+        "profile": stats(profile["profiler"]) if profile["profiler"] is not None else None
+    }
+    os.makedirs(PROFILER_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{request.endpoint or 'unmatched'}.json"
+    with open(os.path.join(PROFILER_DIR, name), 'w') as output:
+        json.dump(report, output, indent=2)
+
+    response.headers['X-Profile'] = (
+        f"total_ms={elapsed * 1000:.1f}; sql_ms={report['sql']['duration'] * 1000:.1f}; "
+        f"queries={len(queries)}; repeated={len(report['sql']['repeated'])}; report={name}"
+    )
+    return response
+
+
+def setup_profiler(app):
+    app.before_request(start_profile)
+    app.after_request(end_profile)
@@ -0,0 +1,111 @@
+"""
+Read replicas: the SELECTs of GET requests go to one of DB_REPLICA_URLS, writes, flushes and
+every other request use the primary. Two rules keep the replication lag out of sight:
+after a write the same client (a signed cookie) reads from the primary for DB_STICKY_SECONDS,
+and so does everybody reading a model written in that window, otherwise the shared cache would be
+filled with rows the replica doesn't have yet. The second rule needs the write times of every
+worker, so replicas can't be used with the per-process memory cache backend.
+"""
+import os
+import math
+import time
+import random
+import sqlite3
+from flask import request, g, has_request_context, current_app
+from flask_sqlalchemy.session import Session
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from sqlalchemy import Select
+from sqlalchemy.engine import make_url
+from pool import engine_options
+from cache import cache, MemoryBackend
+
+DB_REPLICA_URLS = [url.strip() for url in os.environ.get('DB_REPLICA_URLS', '').split(',') if url.strip()]
+DB_STICKY_SECONDS = float(os.environ.get('DB_STICKY_SECONDS', 5))
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+REPLICAS = [f"replica_{index}" for index in range(len(DB_REPLICA_URLS))]
+STICKY_COOKIE = 'read_primary'
+
+
+def replica_binds():
+    # SQLALCHEMY_BINDS entries, no model is bound to them so create_all() leaves them alone
+    return {key: dict(engine_options(url), url=url) for key, url in zip(REPLICAS, DB_REPLICA_URLS)}
+
+
+def recently_written(model):
+    return model is not None and time.time() - cache.modified(model.__name__) < DB_STICKY_SECONDS
+
+
+def replica_read(model):
+    # whether this request may read `model` (or None for no model) from a replica
+    return (
+        bool(REPLICAS) and has_request_context() and request.method in READ_METHODS
+        and not g.get('read_primary') and not recently_written(model)
+    )
+
+
+def request_replica():
+    # one replica per request, so it sees a single snapshot
+    if 'replica' not in g:
+        g.replica = random.choice(REPLICAS)
+    return g.replica
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.reads_from_replica(mapper, clause):
+            return self._db.engines[request_replica()]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def reads_from_replica(self, mapper, clause):
+        return not self._flushing and isinstance(clause, Select) and replica_read(mapper.class_ if mapper is not None else None)
+
+
+def signer():
+    return URLSafeTimedSerializer(current_app.config['JWT_SECRET_KEY'], salt='sticky')
+
+
+def check_sticky():
+    # the cookie is signed with a timestamp, an old or forged one is ignored
+    if REPLICAS and request.method in READ_METHODS and STICKY_COOKIE in request.cookies:
+        try:
+            g.read_primary = signer().loads(request.cookies[STICKY_COOKIE], max_age=DB_STICKY_SECONDS)
+        except BadSignature:
+            g.read_primary = False
+
+
+def mark_sticky(response):
+    if REPLICAS and request.method not in READ_METHODS and response.status_code < 400:
+        response.set_cookie(STICKY_COOKIE, signer().dumps(True), max_age=math.ceil(DB_STICKY_SECONDS), httponly=True, samesite='Lax')
+    return response
+
+
+def replicate(primary):
+    # local stand-in for replication: copies a SQLite primary over the SQLite replicas
+    source = make_url(primary)
+    if source.get_backend_name() != 'sqlite':
+        print("Only SQLite databases can be copied, real replicas replicate themselves")
+        return
+    with sqlite3.connect(source.database) as origin:
+        for url in DB_REPLICA_URLS:
+            target = make_url(url)
+            if target.get_backend_name() != 'sqlite':
+                print(f"Skipped {url}: not a SQLite database")
+                continue
+            with sqlite3.connect(target.database) as copy:
+                origin.backup(copy)
+            print(f"Copied {source.database} -> {target.database}")
+
+
+def setup_replicas(app):
+    if REPLICAS and isinstance(cache, MemoryBackend):
+        raise RuntimeError("DB_REPLICA_URLS needs a shared cache (CACHE_BACKEND=sqlite or redis)")
+    if REPLICAS and not app.config.get('JWT_SECRET_KEY'):
+        raise RuntimeError("DB_REPLICA_URLS needs FLASK_APP_KEY to sign the read-your-writes cookie")
+    app.before_request(check_sticky)
+    app.after_request(mark_sticky)
+
+    @app.cli.command('replicate')
+    def replicate_command():
+        """Copy the SQLite primary into the SQLite replicas."""
+        replicate(app.config['SQLALCHEMY_DATABASE_URI'])
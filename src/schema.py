@@ -0,0 +1,107 @@
+"""
+Per-model coercion compiled once at import time: every column gets its coercer up front
+instead of looking up the column type for every value of every row.
+"""
+import math
+from sqlalchemy import Integer, Float, String
+from utils import APIException
+
+# what SWAPI uses for "no value" in numeric fields
+UNKNOWN = ('unknown', 'n/a', 'none', '')
+# sync stamps, written by the server and never loaded from a request
+STAMPS = ('version', 'updated_at')
+
+
+class ValidationError(APIException):
+
+    def __init__(self, errors):
+        message = "; ".join(f"{field}: {error}" for field, error in errors.items())
+        APIException.__init__(self, message, status_code=400, payload={"errors": errors})
+        self.errors = errors
+
+
+def to_number(value):
+    if isinstance(value, bool):
+        raise TypeError("must be a number")
+    if isinstance(value, str):
+        # SWAPI writes big numbers as "1,358" and missing ones as "unknown"
+        text = value.strip().replace(',', '')
+        if text.lower() in UNKNOWN:
+            return None
+        try:
+            value = float(text) if '.' in text or 'e' in text.lower() else int(text)
+        except ValueError:
+            raise ValueError("must be a number")
+    elif not isinstance(value, (int, float)):
+        raise TypeError("must be a number")
+    # "1e400", inf and nan would overflow the integer columns or poison the float ones
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("must be a finite number")
+    return value
+
+
+def to_int(value):
+    number = to_number(value)
+    return None if number is None else int(round(number))
+
+
+def to_float(value):
+    number = to_number(value)
+    return None if number is None else float(number)
+
+
+def string_coercer(length):
+    def to_string(value):
+        if isinstance(value, (dict, list, bool)) or value is None:
+            raise TypeError("must be a string")
+        text = str(value).strip()
+        if length is not None and len(text) > length:
+            raise ValueError(f"must have at most {length} characters")
+        return text
+    return to_string
+
+
+def coercer_for(column):
+    if isinstance(column.type, Integer):
+        return to_int
+    if isinstance(column.type, Float):
+        return to_float
+    if isinstance(column.type, String):
+        return string_coercer(column.type.length)
+    return lambda value: value
+
+
+class Schema:
+
+    def __init__(self, model):
+        self.fields = [
+            (column.name, coercer_for(column), column.nullable)
+            for column in model.__table__.columns if not column.primary_key and column.name not in STAMPS
+        ]
+        self.columns = [name for name, _, _ in self.fields]
+        self.required = tuple(name for name, _, nullable in self.fields if not nullable)
+
+    def load(self, data, required=()):
+        # coerced values for the known keys of `data`, the rest is ignored
+        values = {}
+        errors = {}
+        for name, coerce, nullable in self.fields:
+            if name not in data:
+                continue
+            try:
+                value = coerce(data[name])
+            except (TypeError, ValueError) as error:
+                errors[name] = error.args[0]
+                continue
+            # a blank string is no value either
+            if (value is None or value == "") and not nullable:
+                errors[name] = "is required"
+            else:
+                values[name] = value
+
+        for name in required:
+            if name not in values and name not in errors:
+                errors[name] = "is required"
+        if errors:
+            raise ValidationError(errors)
+        return values
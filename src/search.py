@@ -0,0 +1,114 @@
+"""
+Name search for the autocomplete of people and planets, answered by the database so nothing has
+to be built or kept in process. PostgreSQL uses the pg_trgm GiST indexes (prefix matches first,
+then similar names, both ordered by trigram distance), SQLite an FTS5 index over the names where
+every word is an entry, so "sky" finds "Luke Skywalker", and the other databases (MySQL) a prefix
+LIKE on the name index.
+"""
+import os
+import re
+import json
+from flask import request
+from models import db, People, Planets
+from utils import APIException
+from cache import cached, version
+
+SEARCH_LIMIT = int(os.environ.get('SEARCH_LIMIT', 10))
+SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', 50))
+# candidate names read per lookup, bounds the cost of one letter queries
+SEARCH_SCAN = int(os.environ.get('SEARCH_SCAN', 2000))
+
+MODELS = {'people': People, 'planets': Planets}
+WORD = re.compile(r'\w+')
+
+
+def rank(query, rows, limit):
+    # rows: (id, name) -> [(id, name, score)]: matches on the start of the name first, then shorter names
+    query = query.lower()
+    names = dict(rows)
+    ranked = sorted(names.items(), key=lambda row: (not row[1].lower().startswith(query), len(row[1]), row[1]))
+    return [
+        (row_id, name, round(len(query) / len(name) * (1 if name.lower().startswith(query) else 0.5), 3))
+        for row_id, name in ranked[:limit]
+    ]
+
+
+def trigram_lookup(model, query, limit):
+    name = model.name
+    distance = name.op('<->')(query)
+    score = db.func.similarity(name, query)
+    prefix = db.session.query(model.id, name, score).filter(name.istartswith(query, autoescape=True)).order_by(distance).limit(limit).all()
+    similar = db.session.query(model.id, name, score).filter(name.op('%')(query)).order_by(distance).limit(limit).all()
+
+    seen = set()
+    results = []
+    for row_id, row_name, row_score in prefix + similar:
+        if row_id not in seen:
+            seen.add(row_id)
+            results.append((row_id, row_name, round(float(row_score), 3)))
+    return results[:limit]
+
+
+def fts_lookup(model, query, limit):
+    # the words of the query in a row, the last one as a prefix. Names that start with it
+    # come first, the ones where it starts at an inner word only fill the remaining places.
+    words = WORD.findall(query.lower())
+    if not words:
+        return []
+    phrase = " + ".join(f'"{word}"' for word in words) + " *"
+    table = model.__tablename__
+    statement = db.text(
+        f"SELECT {table}.id, {table}.name FROM {table}_fts JOIN {table} ON {table}.id = {table}_fts.rowid "
+        f"WHERE {table}_fts MATCH :phrase LIMIT :scan"
+    )
+    rows = db.session.execute(statement, {"phrase": f"^ {phrase}", "scan": SEARCH_SCAN}).all()
+    if len(rows) < limit:
+        rows += db.session.execute(statement, {"phrase": phrase, "scan": SEARCH_SCAN}).all()
+    return rank(query, rows, limit)
+
+
+def prefix_lookup(model, query, limit):
+    # name LIKE 'query%' walks the name index (MySQL compares case-insensitively)
+    pattern = query.replace('/', '//').replace('%', '/%').replace('_', '/_') + '%'
+    rows = db.session.query(model.id, model.name).filter(model.name.like(pattern, escape='/')).order_by(model.name).limit(SEARCH_SCAN).all()
+    return rank(query, rows, limit)
+
+
+def lookup(model, query, limit):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return trigram_lookup(model, query, limit)
+    if dialect == 'sqlite':
+        return fts_lookup(model, query, limit)
+    return prefix_lookup(model, query, limit)
+
+
+def search():
+    # ?q=<text>&type=people,planets&limit=n
+    query = request.args.get('q', '').strip()
+    if not query:
+        raise APIException("q is required", status_code=400)
+
+    types = request.args.get('type', 'people,planets').split(',')
+    unknown = [name for name in types if name not in MODELS]
+    if unknown:
+        raise APIException(f"type must be one of {', '.join(MODELS)}", status_code=400)
+
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_LIMIT)), SEARCH_MAX_LIMIT)
+    except ValueError:
+        raise APIException("limit must be an integer", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+
+    def load():
+        results = [
+            {"type": name, "id": row_id, "name": row_name, "score": score}
+            for name in types
+            for row_id, row_name, score in lookup(MODELS[name], query, limit)
+        ]
+        return sorted(results, key=lambda result: -result["score"])[:limit]
+
+    versions = "-".join(str(version(model.__name__)) for model in MODELS.values())
+    args = json.dumps([query.lower(), sorted(types), limit])
+    return cached(f"search:{versions}:{args}", load)
@@ -0,0 +1,50 @@
+"""
+Fast JSON rendering: orjson when it is installed (stdlib json otherwise) and rows
+rendered straight from column tuples, without building ORM objects
+"""
+import json
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # plugged in as app.json, so jsonify() and request.json go through it
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=self.default).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default) + b'\n', mimetype=self.mimetype
+        )
+
+
+def dumps(obj):
+    # str for the streaming endpoints
+    if orjson is not None:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default).decode()
+    return json.dumps(obj, default=DefaultJSONProvider.default)
+
+
+def columns(model, fields=None):
+    fields = fields or model.public
+    return [getattr(model, name) for name in fields]
+
+
+def render(rows, fields):
+    # column tuples -> dicts, the same shape serialize() produces (extra trailing columns are ignored)
+    return [dict(zip(fields, row)) for row in rows]
@@ -0,0 +1,144 @@
+"""
+Helpers to pull data from SWAPI (https://swapi.dev) in order to populate the database
+"""
+import os
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+####################
+# URL reutilizable #
+####################
+URL_BASE = "https://swapi.dev/api"
+
+SWAPI_CONCURRENCY = int(os.environ.get('SWAPI_CONCURRENCY', 8))
+SWAPI_TIMEOUT = float(os.environ.get('SWAPI_TIMEOUT', 10))
+# live | record | replay
+SWAPI_SOURCE = os.environ.get('SWAPI_SOURCE', 'live')
+SWAPI_SNAPSHOT = os.environ.get('SWAPI_SNAPSHOT', 'swapi_snapshot.jsonl.gz')
+
+# one pooled session shared by every request so the TCP/TLS connections get reused
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=SWAPI_CONCURRENCY))
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=SWAPI_CONCURRENCY))
+
+
+def get_json(url):
+    response = session.get(url, timeout=SWAPI_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_details(urls, concurrency=None):
+    # at most `concurrency` requests in flight, results keep the order of `urls`
+    concurrency = max(1, min(concurrency or SWAPI_CONCURRENCY, SWAPI_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(get_json, urls))
+
+
+def swapi_id(url):
+    # https://swapi.dev/api/people/1/ -> 1
+    return int(url.rstrip('/').rsplit('/', 1)[-1])
+
+
+def page_url(resource, page=1, limit=20):
+    return f'{URL_BASE}/{resource}/?page={page}&limit={limit}'
+
+
+def fetch_listing(url, concurrency=None):
+    response = get_json(url)
+    details = fetch_details([result['url'] for result in response['results']], concurrency)
+    return details, response.get('next')
+
+
+def fetch_page(resource, page=1, limit=20, concurrency=None):
+    details, _ = fetch_listing(page_url(resource, page, limit), concurrency)
+    return details
+
+
+def crawl(resource, start_page=1, concurrency=None):
+    # follows the `next` links yielding (page, details), the next page is
+    # downloaded in the background while the caller is busy with the current one
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        page = start_page
+        future = prefetcher.submit(fetch_listing, page_url(resource, page), concurrency)
+
+        while future is not None:
+            details, next_url = future.result()
+            future = prefetcher.submit(fetch_listing, next_url, concurrency) if next_url else None
+            yield page, details
+            page += 1
+
+
+################
+# Data sources #
+################
+# Every source exposes page() and pages() so the population endpoints
+# don't care whether the data comes from the network or from disk.
+
+class LiveSource:
+
+    def page(self, resource, page=1, concurrency=None):
+        return fetch_page(resource, page, concurrency=concurrency)
+
+    def pages(self, resource, start_page=1, concurrency=None):
+        return crawl(resource, start_page, concurrency)
+
+
+class RecordingSource:
+    # reads from another source and appends every page to a gzip JSONL snapshot
+
+    def __init__(self, path=SWAPI_SNAPSHOT, source=None):
+        self.path = path
+        self.source = source or LiveSource()
+
+    def record(self, resource, page, details):
+        with gzip.open(self.path, 'at', encoding='utf-8') as snapshot:
+            snapshot.write(json.dumps({"resource": resource, "page": page, "results": details}) + '\n')
+
+    def page(self, resource, page=1, concurrency=None):
+        details = self.source.page(resource, page, concurrency)
+        self.record(resource, page, details)
+        return details
+
+    def pages(self, resource, start_page=1, concurrency=None):
+        for page, details in self.source.pages(resource, start_page, concurrency):
+            self.record(resource, page, details)
+            yield page, details
+
+
+class SnapshotSource:
+    # replays a snapshot written by RecordingSource, no network involved
+
+    def __init__(self, path=SWAPI_SNAPSHOT):
+        self.path = path
+
+    def read(self, resource):
+        # when a page was recorded more than once the latest copy wins
+        pages = {}
+        with gzip.open(self.path, 'rt', encoding='utf-8') as snapshot:
+            for line in snapshot:
+                entry = json.loads(line)
+                if entry["resource"] == resource:
+                    pages[entry["page"]] = entry["results"]
+        return pages
+
+    def page(self, resource, page=1, concurrency=None):
+        return self.read(resource).get(page, [])
+
+    def pages(self, resource, start_page=1, concurrency=None):
+        pages = self.read(resource)
+        for page in sorted(pages):
+            if page >= start_page:
+                yield page, pages[page]
+
+
+def get_source(name=None):
+    name = name or SWAPI_SOURCE
+    if name == 'record':
+        return RecordingSource()
+    if name == 'replay':
+        return SnapshotSource()
+    return LiveSource()
@@ -0,0 +1,180 @@
+"""
+Delta sync: every write to People, Planets or Favorites takes a version from a global clock
+(SyncClock) and every delete leaves a Tombstone, so /sync?since=<version> answers with the rows
+changed after what the client already has. ORM writes are stamped in before_flush, the bulk
+statements (upsert, batch update and delete) stamp their rows themselves.
+
+The clock row stays locked from the first write of a transaction to its commit, so a version
+is never visible before the lower ones: reading the clock first and nothing above it gives a
+consistent cut, and the version returned to the client can't skip a change still in flight.
+
+Known limit: that lock serializes every writing transaction of every worker, a slow one (a
+whole seed page) holds all the others up, so write throughput is capped at one transaction at a
+time. A database sequence for the versions, plus a watermark of the highest version below which
+everything is committed for /sync to read up to, would let writers run in parallel.
+"""
+import os
+from flask import request
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from sqlalchemy import event
+from models import db, People, Planets, Favorites, SyncClock, ScopeVersion, Tombstone, reserve, pending_changes
+from replicas import RoutingSession
+from utils import APIException
+from cache import mark_written, read_versions_with
+
+SYNC_LIMIT = int(os.environ.get('SYNC_LIMIT', 500))
+SYNC_MAX_LIMIT = int(os.environ.get('SYNC_MAX_LIMIT', 5000))
+
+# /sync key -> model, favorites only for the user of the token
+MODELS = {'people': People, 'planets': Planets, 'favorites': Favorites}
+VERSIONED = tuple(MODELS.values())
+
+
+def scopes(model, user_ids=()):
+    # the version slices a write touches: the model, and each user's rows for the favorites
+    return [model.__name__] + [f"{model.__name__}:{user_id}" for user_id in set(user_ids) if user_id is not None]
+
+
+def tombstones(session, model, rows, first, deleted_at):
+    # rows: [(id, user_id or None)], versions first, first + 1, ...
+    session.add_all([
+        Tombstone(model=model.__name__, row_id=row_id, user_id=user_id, version=first + offset, deleted_at=deleted_at)
+        for offset, (row_id, user_id) in enumerate(rows)
+    ])
+
+
+def delete_rows(model, rows):
+    # bulk DELETE of rows [(id, user_id or None)] with their tombstones, in the current transaction
+    if not rows:
+        return
+    first, deleted_at = reserve(db.session, len(rows), scopes(model, [user_id for _, user_id in rows]))
+    db.session.execute(db.delete(model).where(model.id.in_([row_id for row_id, _ in rows])))
+    tombstones(db.session, model, rows, first, deleted_at)
+    mark_written(db.session, model)
+    for user_id in {user_id for _, user_id in rows if user_id is not None}:
+        mark_written(db.session, model, user_id)
+
+
+def stamp_rows(model, items):
+    # bulk UPDATE parameter sets -> the same sets with their version and updated_at
+    first, updated_at = reserve(db.session, len(items), scopes(model))
+    items = [dict(item, version=first + offset, updated_at=updated_at) for offset, item in enumerate(items)]
+    mark_written(db.session, model)
+    pending_changes(db.session).extend(
+        {"type": model.__tablename__, "action": "updated", "id": item["id"], "version": item["version"], "user_id": None}
+        for item in items
+    )
+    return items
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def stamp_flush(session, flush_context, instances):
+    changed = [
+        instance for instance in session.new | session.dirty
+        if isinstance(instance, VERSIONED) and (instance in session.new or session.is_modified(instance))
+    ]
+    deleted = [instance for instance in session.deleted if isinstance(instance, VERSIONED)]
+    if not changed and not deleted:
+        return
+
+    written = {
+        scope for instance in changed + deleted
+        for scope in scopes(type(instance), [getattr(instance, 'user_id', None)])
+    }
+    first, now = reserve(session, len(changed) + len(deleted), written)
+    for offset, instance in enumerate(changed):
+        instance.version = first + offset
+        instance.updated_at = now
+    first += len(changed)
+    for model in VERSIONED:
+        rows = [(instance.id, getattr(instance, 'user_id', None)) for instance in deleted if isinstance(instance, model)]
+        tombstones(session, model, rows, first, now)
+        first += len(rows)
+
+
+def backfill():
+    # rows written around the ORM (bulk loads, old rows) still have version 0, they get
+    # versions above the clock in id order
+    total = 0
+    for model in VERSIONED:
+        top = db.session.query(db.func.max(model.id)).filter(model.version == 0).scalar()
+        if top is None:
+            continue
+        first, now = reserve(db.session, top, scopes(model))
+        total += model.query.filter(model.version == 0).update(
+            {"version": model.id + first - 1, "updated_at": now}, synchronize_session=False)
+        mark_written(db.session, model)
+        db.session.commit()
+    return total
+
+
+def versions_statement(names):
+    return db.select(ScopeVersion.scope, ScopeVersion.version, ScopeVersion.updated_at).where(ScopeVersion.scope.in_(names))
+
+
+# with the memory backend the ETags and cache keys of these models read ScopeVersion
+read_versions_with([model.__name__ for model in VERSIONED], versions_statement)
+
+
+def sync_limit():
+    try:
+        limit = min(int(request.args.get('limit', SYNC_LIMIT)), SYNC_MAX_LIMIT)
+    except ValueError:
+        raise APIException("limit must be an integer", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+    return limit
+
+
+def changes():
+    # ?since=<version>&limit=n -> the oldest `limit` changes after `since`, deletes included.
+    # `version` is the since of the next call, `more` tells if there are changes left.
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        raise APIException("since must be an integer", status_code=400)
+    limit = sync_limit()
+
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+    models = {name: model for name, model in MODELS.items() if model is not Favorites or user_id is not None}
+
+    # nothing above the committed clock, a write in flight can't be skipped
+    clock = db.session.query(SyncClock.version).filter_by(id=1).scalar() or 0
+
+    # one more than `limit` from every table tells if anything is left after the `limit` oldest
+    events = []
+    for name, model in models.items():
+        rows = model.query.filter(model.version > since, model.version <= clock)
+        deleted = Tombstone.query.filter(Tombstone.model == model.__name__, Tombstone.version > since, Tombstone.version <= clock)
+        if model is Favorites:
+            rows = rows.filter(model.user_id == user_id)
+            deleted = deleted.filter(Tombstone.user_id == user_id)
+        events += [(row.version, name, "changed", row) for row in rows.order_by(model.version).limit(limit + 1)]
+        events += [(row.version, name, "deleted", row) for row in deleted.order_by(Tombstone.version).limit(limit + 1)]
+    events.sort(key=lambda change: change[0])
+
+    more = len(events) > limit
+    events = events[:limit]
+    result = {name: {"changed": [], "deleted": []} for name in models}
+    for row_version, name, kind, row in events:
+        if kind == "deleted":
+            result[name]["deleted"].append(row.serialize())
+        else:
+            result[name]["changed"].append(dict(
+                row.serialize(), id=row.id, version=row_version,
+                updated_at=row.updated_at.isoformat() if row.updated_at else None
+            ))
+    return {
+        "since": since,
+        "version": events[-1][0] if more else max(clock, since),
+        "more": more,
+        "changes": result
+    }
+
+
+def setup_sync(app):
+    @app.cli.command('sync-backfill')
+    def backfill_command():
+        """Give a sync version to the rows that don't have one."""
+        print(f"Stamped {backfill()} rows")
@@ -1,4 +1,8 @@
-from flask import jsonify, url_for
+import json
+import base64
+from flask import jsonify, url_for, request
+from sqlalchemy import tuple_, select
+from serializers import render
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +19,103 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def page_limit(args=None):
+    args = request.args if args is None else args
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise APIException("limit must be an integer", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+    return min(limit, MAX_PAGE_SIZE)
+
+def encode_cursor(value, row_id):
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(row_id)
+    except Exception:
+        raise APIException("after is not a valid cursor", status_code=400)
+
+def keyset(query, model, sort, limit, after):
+    # keyset pagination: WHERE key > after ORDER BY key LIMIT n, one extra row tells if there is a next page.
+    # Sorting by id uses the plain id as cursor, any other column uses (value, id) encoded as a token.
+    # Works the same on a Query and on a select().
+    descending = sort.startswith('-')
+    column = getattr(model, sort.lstrip('-'))
+
+    if column is model.id:
+        key, order_by = model.id, [model.id.desc() if descending else model.id]
+    else:
+        key = tuple_(column, model.id)
+        order_by = [column.desc(), model.id.desc()] if descending else [column, model.id]
+
+    if after:
+        if column is model.id:
+            try:
+                bound = int(after)
+            except ValueError:
+                raise APIException("after must be an integer", status_code=400)
+        else:
+            bound = tuple_(*decode_cursor(after))
+        query = query.filter(key < bound if descending else key > bound)
+    return query.order_by(*order_by).limit(limit + 1)
+
+def next_page(rows, model, sort, limit):
+    # (rows of this page, cursor of the next one or None)
+    column = getattr(model, sort.lstrip('-'))
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = last.id if column is model.id else encode_cursor(getattr(last, column.key), last.id)
+    return rows[:limit], next_cursor
+
+def paginate(query, model, sort='id'):
+    limit = page_limit()
+    rows = keyset(query, model, sort, limit, request.args.get('after')).all()
+    return next_page(rows, model, sort, limit)
+
+def list_statement(model, args):
+    # ?<column>=a,b filters, ?sort=<column> or -<column>, ?fields=a,b projection.
+    # Returns the SELECT of the page and what list_page needs to render it.
+    statement = select()
+    for name in model.filterable:
+        value = args.get(name)
+        if value:
+            statement = statement.filter(getattr(model, name).in_(value.split(',')))
+
+    sort = args.get('sort', 'id')
+    if sort.lstrip('-') not in model.sortable:
+        raise APIException(f"sort must be one of {', '.join(model.sortable)}", status_code=400)
+
+    fields = args.get('fields')
+    if fields:
+        fields = ['id'] + [name for name in fields.split(',') if name != 'id']
+        unknown = [name for name in fields if name not in model.__table__.columns]
+        if unknown:
+            raise APIException(f"Unknown fields: {', '.join(unknown)}", status_code=400)
+    else:
+        fields = list(model.public)
+
+    # only the needed columns (plus the sort key) are selected and rendered from the tuples, no ORM entities are built
+    selected = fields + [name for name in [sort.lstrip('-')] if name not in fields]
+    limit = page_limit(args)
+    statement = keyset(statement.add_columns(*[getattr(model, name) for name in selected]), model, sort, limit, args.get('after'))
+    return statement, fields, sort, limit
+
+def list_page(rows, model, fields, sort, limit):
+    rows, next_cursor = next_page(rows, model, sort, limit)
+    return render(rows, fields), next_cursor
+
+def list_rows(model):
+    statement, fields, sort, limit = list_statement(model, request.args)
+    return list_page(model.query.session.execute(statement).all(), model, fields, sort, limit)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()